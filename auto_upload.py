@@ -11,28 +11,41 @@ import shutil
 import subprocess
 import sys
 import time
+import threading
 from pathlib import Path
+from concurrent.futures import wait
 
 # These packages need to be installed
 import requests
 from jinja2 import Template
 from dotenv import load_dotenv
-from ffmpy import FFprobe
-from guessit import guessit
-from pymediainfo import MediaInfo
 from requests.exceptions import Timeout
 # Rich is used for printing text & interacting with user input
 from rich import box
 from rich.console import Console
+from rich.progress import Progress
 from rich.prompt import Prompt, Confirm
 from rich.table import Table
 from rich.traceback import install
-from torf import Torrent
 
 # This is used to take screenshots and eventually upload them to either imgbox or imgbb
 from images.upload_screenshots import take_upload_screens
 # Here we search for dupes
 from search_for_dupes import search_for_dupes_api
+# guessit & all our filename regex run once per release name, every stage reads from the record it returns
+from release_name import parse_release_name
+# mediainfo is parsed once per video file, every stage reads tracks/duration/atmos/mediainfo.txt from the same probe
+from media_probe import MediaProbe
+# mediainfo/ffprobe/bdinfo results are cached on disk (keyed by the files identity) so retries & reuploads skip probing
+from probe_cache import ProbeCache
+# Used to quickly pick the video file we use for mediainfo when uploading a folder
+from media_files import build_tree_manifest, find_video_files
+# .mpls/.clpi reader, bdinfo playlist listing & the (background) bdinfo scan for raw bluray discs
+from bluray_disc import read_playlists, find_main_stream_file, list_playlists, find_largest_playlist, start_playlist_scan, cancel_playlist_scan
+# Multi threaded piece hashing for the .torrent (torf still builds the file list & metainfo), it runs in the background while we do everything else
+from torrent_hashing import start_torrent_hashing, find_session_torrent
+# Pieces we've already hashed are kept between runs so uploading the same release again doesn't hash it again
+from piece_hash_store import PieceHashStore
 
 # Used for rich.traceback
 install()
@@ -49,6 +62,10 @@ working_folder = os.path.dirname(os.path.realpath(__file__))
 # Once all necessary info has been collected we will loop through this dict and set the correct tracker API Keys to it
 torrent_info = {}
 
+# torrent_info only stores plain values that we show the user & send to trackers
+# The objects we build while analyzing the upload (e.g. the parsed release name) are kept here instead so every stage can reuse them
+media_analysis = {}
+
 logging.basicConfig(filename='{}/upload_script.log'.format(working_folder),
                     level=logging.INFO,
                     format='%(asctime)s | %(name)s | %(levelname)s | %(message)s')
@@ -98,6 +115,11 @@ else:
 
 bdinfo_script = os.getenv('bdinfo_script')
 
+# Set 'probe_cache_size_mb=0' in config.env to disable the probe cache
+probe_cache = ProbeCache(db_path=f'{working_folder}/cache/probe_cache.sqlite3', max_size_mb=os.getenv('probe_cache_size_mb') or 256)
+# Set 'piece_hash_cache_size_mb=0' in config.env to always hash the .torrent pieces again
+piece_hash_store = PieceHashStore(db_path=f'{working_folder}/cache/piece_hashes.sqlite3', max_size_mb=os.getenv('piece_hash_cache_size_mb') or 64)
+
 is_live_on_site = str(os.getenv('live')).lower()
 
 # Setup args
@@ -119,6 +141,8 @@ parser.add_argument('-e', '--edition', nargs='*', help="Manually provide an 'edi
 parser.add_argument('-nfo', nargs=1, help="Use this to provide the path to an nfo file you want to upload")
 parser.add_argument('-justfile', action='store_true', help="Use this if you want to upload just the file, no external ID's, or rename (e.g. motorsport races)")
 parser.add_argument('-note', nargs=1, help="Show the note passed here in the uploads description")
+parser.add_argument('-source_torrent', nargs=1, help="The .torrent the files were downloaded with, its pieces are reused instead of hashing the files again")
+parser.add_argument('-infohash', nargs=1, help="Infohash of the torrent the files were downloaded with, its .torrent is looked up in 'rtorrent_session_dir'")
 
 # args for Internal uploads
 parser.add_argument('-internal', action='store_true', help="(Internal) Used to mark an upload as 'Internal'", default=argparse.SUPPRESS)
@@ -145,6 +169,53 @@ def delete_leftover_files():
             logging.info("deleted the contents of the folder: {}".format(working_folder + old_temp_data))
 
 
+def get_media_probe():
+    # ffprobe/mediainfo need to access to video file not folder, so we use 'raw_video_file' if its been set
+    parse_me = torrent_info["raw_video_file"] if "raw_video_file" in torrent_info else torrent_info["upload_media"]
+    # Only parse the file once, every stage after this reuses the same MediaProbe
+    if "media_probe" not in media_analysis or media_analysis["media_probe"].path != parse_me:
+        media_analysis["media_probe"] = MediaProbe(parse_me, cache=probe_cache)
+    return media_analysis["media_probe"]
+
+
+def get_tree_manifest():
+    # The upload folder is only walked once, the video file selection, bluray disc size & .torrent creation all reuse this
+    if "tree_manifest" not in media_analysis or os.path.normpath(media_analysis["tree_manifest"].root) != os.path.normpath(torrent_info["upload_media"]):
+        media_analysis["tree_manifest"] = build_tree_manifest(torrent_info["upload_media"])
+    return media_analysis["tree_manifest"]
+
+
+def get_bdinfo_playlists():
+    # 'bdinfo -l' only runs once per disc (and its output is cached on disk), we reuse the result for the rest of the upload
+    if "bdinfo_playlists" not in media_analysis:
+        media_analysis["bdinfo_playlists"] = list_playlists(bdinfo_script=bdinfo_script, disc_path=torrent_info["upload_media"],
+                                                            cache_key_file=torrent_info["raw_video_file"], cache=probe_cache)
+    return media_analysis["bdinfo_playlists"]
+
+
+def verify_bdinfo_script():
+    # Verify that the bdinfo script exists
+    if not bdinfo_script or not os.path.isfile(bdinfo_script):
+        logging.critical("You've specified the '-disc' arg but have not supplied a valid bdinfo script path in config.env")
+        logging.info("Can not upload a raw disc without bdinfo output, update the 'bdinfo_script' path in config.env")
+        raise AssertionError(f"The bdinfo script you specified: ({bdinfo_script}) does not exist")
+
+
+def wait_for_bdinfo_scan():
+    # The bdinfo scan runs in the background while we do everything else, this blocks until its done (if its still running)
+    if "bdinfo_scan" in media_analysis:
+        if not media_analysis["bdinfo_scan"].done():
+            console.print("\nWaiting for the bdinfo scan to finish...", style="dodger_blue1")
+        # The scan returns the (trimmed) report, we keep it in memory for the upload payload
+        media_analysis["mediainfo_report"] = media_analysis["bdinfo_scan"].result()
+
+
+def cancel_bdinfo_scan():
+    # Stop the background bdinfo scan if it's still running (e.g. the upload was aborted)
+    if "bdinfo_scan" in media_analysis:
+        cancel_playlist_scan(media_analysis["bdinfo_scan"])
+
+
 def identify_type_and_basic_info(full_path):
     console.line(count=2)
     console.rule(f"Analyzing & Identifying Video", style='red', align='center')
@@ -154,14 +225,18 @@ def identify_type_and_basic_info(full_path):
     # but we need to do some more work for things like audio channels, codecs, etc (Some groups (D-Z0N3 is a pretty big offender here)
     # for example 'D-Z0N3' used to not include the audio channels in their filename so we need to use ffprobe to get that ourselves (pymediainfo has issues when dealing with atmos and more complex codecs)
 
+    # guessit only runs once here, everything else in this function (and later stages) reads from the same release name record
+    release_name = parse_release_name(full_path)
+    media_analysis["release_name"] = release_name
+
     # ------------ Save obvious info we are almost guaranteed to get from guessit into torrent_info dict ------------ #
     # But we can immediately assign some values now like Title & Year
-    if not guessit(full_path)["title"]:
+    if not release_name.get("title"):
         raise AssertionError("Guessit could not even extract the title, something is really wrong with this filename..")
-    torrent_info["title"] = guessit(full_path)["title"]
+    torrent_info["title"] = release_name["title"]
 
-    if "year" in guessit(full_path):  # Most TV Shows don't have the year included in the filename
-        torrent_info["year"] = str(guessit(full_path)["year"])
+    if "year" in release_name:  # Most TV Shows don't have the year included in the filename
+        torrent_info["year"] = str(release_name["year"])
 
     # ------------ Save basic info we get from guessit into torrent_info dict ------------ #
     # We set a list of the items that are required to successfully build a torrent name later
@@ -182,15 +257,15 @@ def identify_type_and_basic_info(full_path):
     # We can (need to) have some other information in the final torrent title such as 'editions', 'hdr', 'UHD source but 1080p encode', etc
     # All of that is important but not essential right now so we will try to extract that info later in the script
     for basic_key in keys_we_need_torrent_info:
-        if basic_key in guessit(full_path):
-            torrent_info[basic_key] = str(guessit(full_path)[basic_key])
+        if basic_key in release_name:
+            torrent_info[basic_key] = str(release_name[basic_key])
         else:
             keys_we_need_but_missing_torrent_info.append(basic_key)
 
     # As guessit evolves and adds more info we can easily support whatever they add and insert it into our main torrent_info dict
     for wanted_key in keys_we_want_torrent_info:
-        if wanted_key in guessit(full_path):
-            torrent_info[wanted_key] = str(guessit(full_path)[wanted_key])
+        if wanted_key in release_name:
+            torrent_info[wanted_key] = str(release_name[wanted_key])
     # ------------ Format Season & Episode (Goal is 'S01E01' type format) ------------ #
     # Depending on if this is a tv show or movie we have some other 'required' keys that we need (season/episode)
     if "type" not in torrent_info:
@@ -200,10 +275,10 @@ def identify_type_and_basic_info(full_path):
         torrent_info["season_number"] = 0
         torrent_info["episode_number"] = 0
 
-        if 'season' not in guessit(full_path):
+        if 'season' not in release_name:
             logging.error("could not detect the 'season' using guessit")
-            if 'date' in guessit(full_path):  # we can replace the S**E** format with the daily episodes date
-                daily_episode_date = str(guessit(full_path)["date"])
+            if 'date' in release_name:  # we can replace the S**E** format with the daily episodes date
+                daily_episode_date = str(release_name["date"])
                 logging.info('detected a daily episode, using the date ({daily_epi_date}) instead of S**E**'.format(
                     daily_epi_date=daily_episode_date))
                 torrent_info["s00e00"] = daily_episode_date
@@ -215,11 +290,11 @@ def identify_type_and_basic_info(full_path):
 
         else:
             # This else is for when we have a season number, so we can immediately assign it to the torrent_info dict
-            torrent_info["season_number"] = int(guessit(full_path)["season"])
+            torrent_info["season_number"] = int(release_name["season"])
 
             # check if we have an episode number
-            if 'episode' in guessit(full_path):
-                torrent_info["episode_number"] = int(guessit(full_path)["episode"])
+            if 'episode' in release_name:
+                torrent_info["episode_number"] = int(release_name["episode"])
                 torrent_info["s00e00"] = f'S{torrent_info["season_number"]:02d}E{torrent_info["episode_number"]:02d}'
             else:
                 # if we don't have an episode number we will just use the season number
@@ -241,44 +316,43 @@ def identify_type_and_basic_info(full_path):
 
         # First check to see if we are uploading a 'raw bluray disc'
         if args.disc:
-            # Verify that the bdinfo script exists
-            if not os.path.isfile(bdinfo_script):
-                logging.critical("You've specified the '-disc' arg but have not supplied a valid bdinfo script path in config.env")
-                logging.info("Can not upload a raw disc without bdinfo output, update the 'bdinfo_script' path in config.env")
-                raise AssertionError(f"The bdinfo script you specified: ({bdinfo_script}) does not exist")
-
-            # Now that we've "verified" bdinfo is on the system, we can analyze the folder and continue the upload
-
             if not os.path.exists(f'{torrent_info["upload_media"]}BDMV/STREAM/'):
                 logging.critical("BD folder not recognized. We can only upload if we detect a '/BDMV/STREAM/' folder")
                 raise AssertionError("Currently unable to upload .iso files or disc/folders that does not contain a '/BDMV/STREAM/' folder")
 
-            bd_max_size = 0
-            bd_max_file = ""
-            for folder, subfolders, files in os.walk(f'{torrent_info["upload_media"]}BDMV/STREAM/'):
-                # checking the size of each file
-                for bd_file in files:
-                    size = os.stat(os.path.join(folder, bd_file)).st_size
-                    # updating maximum size
-                    if size > bd_max_size:
-                        bd_max_size = size
-                        bd_max_file = os.path.join(folder, bd_file)
-
-            torrent_info["raw_video_file"] = bd_max_file
-
-            bdinfo_output_split = str(' '.join(str(subprocess.check_output([bdinfo_script, torrent_info["upload_media"], "-l"])).split())).split(' ')
-            all_mpls_playlists = re.findall(r'\d\d\d\d\d\.MPLS', str(bdinfo_output_split))
             # In auto_mode we just choose the largest playlist
-            dict_of_playlist_length_size = {}
-            # Still identifying the largest playlist here...
-            for index, mpls_playlist in enumerate(bdinfo_output_split):
-                if mpls_playlist in all_mpls_playlists:
-                    dict_of_playlist_length_size[mpls_playlist] = int(str(bdinfo_output_split[index + 2]).replace(",", ""))
-            largest_playlist_value = max(dict_of_playlist_length_size.values())
-            largest_playlist = list(dict_of_playlist_length_size.keys())[list(dict_of_playlist_length_size.values()).index(largest_playlist_value)]
-            # print(largest_playlist)
+            # We read the playlists (.mpls) & clip info (.clpi) files ourselves, the main feature's largest .m2ts file is what we use for mediainfo & screenshots
+            disc_playlists = read_playlists(torrent_info["upload_media"])
+            largest_playlist = find_largest_playlist({playlist.name: playlist.size for playlist in disc_playlists.values()}) if disc_playlists else None
+            main_stream_file = find_main_stream_file(torrent_info["upload_media"], disc_playlists[largest_playlist]) if largest_playlist else None
+
+            if main_stream_file:
+                logging.info(f"Main playlist: {largest_playlist} ({disc_playlists[largest_playlist].duration:.0f} seconds), using {main_stream_file}")
+                torrent_info["raw_video_file"] = main_stream_file
+            else:
+                # Fallback for discs we can't read the playlists from, use the largest .m2ts file & ask bdinfo which playlist is the largest
+                logging.error("Could not find the main playlist from the .mpls files, falling back to 'bdinfo -l'")
+                verify_bdinfo_script()
+
+                largest_stream_file = get_tree_manifest().largest_file('BDMV', 'STREAM')
+                if largest_stream_file is None:
+                    raise AssertionError(f"The folder {torrent_info['upload_media']}BDMV/STREAM/ is empty")
+                torrent_info["raw_video_file"] = largest_stream_file.path
+                largest_playlist = find_largest_playlist(get_bdinfo_playlists())
+
             torrent_info["largest_playlist"] = largest_playlist
 
+            # The playlist was picked without bdinfo but we still need it for the full report (mediainfo.txt)
+            verify_bdinfo_script()
+
+            # Now that we know which playlist to use we can start the (slow) full bdinfo scan in the background
+            # TMDB lookups, screenshots, dupe checks etc all happen while it runs & we only wait for it right before we need mediainfo.txt
+            media_analysis["bdinfo_scan"] = start_playlist_scan(
+                bdinfo_script=bdinfo_script, disc_path=torrent_info["upload_media"], raw_file_name=release_name.raw_file_name,
+                playlist=largest_playlist, save_location=f'{working_folder}/temp_upload/mediainfo.txt',
+                cache_key_file=torrent_info["raw_video_file"], cache=probe_cache
+            )
+
 
         else:
             #
@@ -302,45 +376,18 @@ def identify_type_and_basic_info(full_path):
                     console.print(f"Ok, we'll use [bold]{list_of_possible_files[int(selected_file) - 1]}[/bold] for mediainfo", style="dodger_blue1")
                     torrent_info["raw_video_file"] = list_of_possible_files[int(selected_file) - 1]
 
-            for individual_file in list_of_possible_files:
-                while "raw_video_file" not in torrent_info:
-                    if os.path.isfile(individual_file):
-                        file_info = MediaInfo.parse(individual_file)
-                        for track in file_info.tracks:
-                            if track.track_type == "Video":
-                                torrent_info["raw_video_file"] = individual_file
-                                logging.info(f"Using {individual_file} for mediainfo tests")
-                                break
-                            else:
-                                continue
-                    else:
-                        continue
-
             if "raw_video_file" not in torrent_info:
-                logging.critical("Unable to find a video file to use for mediainfo")
-                raise AssertionError("Unable to find a video file to use for mediainfo")
-
-            # -------------------------------------------------- #
-
-            # Now that we've "verified" mediainfo is on the system, we can analyze the folder and continue the upload
-
-
-                pass
-
-            else:
-                for individual_file in sorted(glob.glob(f"{torrent_info['upload_media']}/*")):
-                    found = False  # this is used to break out of the double nested loop
-                    logging.info(f"Checking to see if {individual_file} is a video file")
-                    if os.path.isfile(individual_file):
-                        file_info = MediaInfo.parse(individual_file)
-                        for track in file_info.tracks:
-                            if track.track_type == "Video":
-                                torrent_info["raw_video_file"] = individual_file
-                                logging.info(f"Using {individual_file} for mediainfo tests")
-                                found = True
-                                break
-                        if found:
-                            break
+                # Only files that look like videos (extension & container magic bytes) outside of sample/proof folders are considered, largest first
+                # That way we only need to run mediainfo on the file we actually end up using (unless its somehow not a video file, then we try the next one)
+                for individual_file in find_video_files(get_tree_manifest()):
+                    file_probe = MediaProbe(individual_file, cache=probe_cache)
+                    if file_probe.has_track_type("Video"):
+                        torrent_info["raw_video_file"] = individual_file
+                        # Keep the probe around so we don't parse the video file again later
+                        media_analysis["media_probe"] = file_probe
+                        logging.info(f"Using {individual_file} for mediainfo tests")
+                        break
+                    logging.info(f"{individual_file} does not have a video track, trying the next file")
 
         if 'raw_video_file' not in torrent_info:
             logging.critical(f"The folder {torrent_info['upload_media']} does not contain any video files")
@@ -348,10 +395,8 @@ def identify_type_and_basic_info(full_path):
             return "skip_to_next_file"
             # sys.exit(f"The folder {torrent_info['upload_media']} does not contain any video files")
 
-        torrent_info["raw_file_name"] = os.path.basename(os.path.dirname(f"{full_path}/"))  # this is used to isolate the folder name
-    else:
-        # For regular movies and single video files we can use the following the just get the filename
-        torrent_info["raw_file_name"] = os.path.basename(full_path)  # this is used to isolate the file name
+    # this is used to isolate the folder name (folders) or the file name (regular movies and single video files)
+    torrent_info["raw_file_name"] = release_name.raw_file_name
 
     # ------------ GuessIt doesn't return a video/audio codec that we should use ------------ #
     # For 'x264', 'AVC', and 'H.264' GuessIt will return 'H.264' which might be a little misleading since things like 'x264' is used for encodes while AVC for Remuxs (usually) etc
@@ -373,12 +418,12 @@ def identify_type_and_basic_info(full_path):
             keys_we_need_but_missing_torrent_info.append(identify_me)
 
     # Deal with PDTV & SDTV sources
-    use_path = full_path if "raw_video_file" not in torrent_info else torrent_info["raw_video_file"]
-    if 'source' in guessit(use_path):
-        if guessit(use_path)['source'] == 'Digital TV':
-            torrent_info['source'] = 'PDTV'
-        if guessit(use_path)['source'] == 'TV':
-            torrent_info['source'] = 'SDTV'
+    # (parse_release_name is cached so if there is no 'raw_video_file' this won't run guessit again)
+    video_release_name = parse_release_name(full_path if "raw_video_file" not in torrent_info else torrent_info["raw_video_file"])
+    if video_release_name.get('source') == 'Digital TV':
+        torrent_info['source'] = 'PDTV'
+    if video_release_name.get('source') == 'TV':
+        torrent_info['source'] = 'SDTV'
 
 
     #  Now we'll try to use regex, mediainfo, ffprobe etc to try and auto get that required info
@@ -421,17 +466,15 @@ def identify_type_and_basic_info(full_path):
 def analyze_video_file(missing_value):
     # console.print(f"\nTrying to identify the [bold][green]{missing_value}[/green][/bold]...")
 
-    # ffprobe/mediainfo need to access to video file not folder, set that here using the 'parse_me' variable
-    parse_me = torrent_info["raw_video_file"] if "raw_video_file" in torrent_info else torrent_info["upload_media"]
-    media_info = MediaInfo.parse(parse_me)
+    # ffprobe/mediainfo need to access to video file not folder, get_media_probe() takes care of that
+    # The file is only parsed the first time we get here, every other missing_value reuses the same probe
+    media_probe = get_media_probe()
+    # All the regex we run on the filename was already done when we analyzed the release name
+    release_name = media_analysis["release_name"]
 
-    # In pretty much all cases "media_info.tracks[1]" is going to be the video track and media_info.tracks[2] will be the primary audio track
-    media_info_video_track = media_info.tracks[1]
-    # I've encountered a media file without an audio track one time... this try/exception should handle any future situations like that
-    try:
-        media_info_audio_track = media_info.tracks[2]
-    except IndexError:
-        media_info_audio_track = None
+    # In pretty much all cases "media_info.tracks[1]" is going to be the video track and media_info.tracks[2] will be the primary audio track (or None if there isn't one)
+    media_info_video_track = media_probe.video_track
+    media_info_audio_track = media_probe.audio_track
 
     # ------------ Save mediainfo to txt ------------ #
     if missing_value == "mediainfo":
@@ -447,40 +490,21 @@ def analyze_video_file(missing_value):
             # depending on if the user is uploading a folder or file we need for format it correctly so we replace the entire path with just media file/folder name
             logging.info(f"Using the following path in mediainfo.txt: {essential_path}")
 
-            media_info_output = str(MediaInfo.parse(parse_me, output="text", full=False)).replace(parse_me, essential_path)
+            media_info_output = media_probe.mediainfo_text(essential_path)
             save_location = str(working_folder + '/temp_upload/mediainfo.txt')
             logging.info(f'Saving mediainfo to: {save_location}')
 
             with open(save_location, 'w+') as f:
                 f.write(media_info_output)
+            media_analysis["mediainfo_report"] = media_info_output
             # now save the mediainfo txt file location to the dict
             # torrent_info["mediainfo"] = save_location
             return save_location
 
 
         else:
-            # Get the BDInfo, parse & save it all into a file called mediainfo.txt (filename doesn't really matter, it gets uploaded to the same place anyways)
-            bdinfo_output_split = str(' '.join(str(subprocess.check_output([bdinfo_script, torrent_info["upload_media"], "-l"])).split())).split(' ')
-            all_mpls_playlists = re.findall(r'\d\d\d\d\d\.MPLS', str(bdinfo_output_split))
-
-            dict_of_playlist_length_size = {}
-
-            for index, mpls_playlist in enumerate(bdinfo_output_split):
-                if mpls_playlist in all_mpls_playlists:
-                    dict_of_playlist_length_size[mpls_playlist] = int(str(bdinfo_output_split[index + 2]).replace(",", ""))
-
-            largest_playlist_value = max(dict_of_playlist_length_size.values())
-            largest_playlist = list(dict_of_playlist_length_size.keys())[list(dict_of_playlist_length_size.values()).index(largest_playlist_value)]
-
-            subprocess.run([bdinfo_script, torrent_info["upload_media"], "--mpls=" + largest_playlist])
-
-            shutil.move(f'{torrent_info["upload_media"]}BDINFO.{torrent_info["raw_file_name"]}.txt', f'{working_folder}/temp_upload/mediainfo.txt')
-            if os.path.isfile("/usr/bin/sed"):
-                sed_path = "/usr/bin/sed"
-            else:
-                sed_path = "/bin/sed"
-            os.system(f"{sed_path} -i '0,/<---- END FORUMS PASTE ---->/d' {working_folder}/temp_upload/mediainfo.txt")
-            # torrent_info["mediainfo"] = f'{working_folder}/temp_upload/mediainfo.txt'
+            # The BDInfo scan was started in the background as soon as we found the largest playlist (see identify_type_and_basic_info)
+            # It saves the report to mediainfo.txt (filename doesn't really matter, it gets uploaded to the same place anyways) & we wait for it before uploading
             return f'{working_folder}/temp_upload/mediainfo.txt'
 
     def quit_log_reason(reason):
@@ -563,46 +587,24 @@ def analyze_video_file(missing_value):
     # ---------------- Audio Channels ---------------- #
     if missing_value == "audio_channels":
 
-        # First try detecting the 'audio_channels' using regex
-        if "raw_file_name" in torrent_info:
-            # First split the filename by '-' & '.'
-            file_name_split = re.sub(r'[-.]', ' ', str(torrent_info["raw_file_name"]))
-            # Now search for the audio channels
-            re_extract_channels = re.search(r'\s[0-9]\s[0-9]\s', file_name_split)
-            if re_extract_channels is not None:
-                # Because this isn't something I've tested extensively I'll only consider it a valid match if its a super common channel layout (e.g.  7.1  |  5.1  |  2.0  etc)
-                re_extract_channels = re_extract_channels.group().split()
-                mid_pos = len(re_extract_channels) // 2
-                # joining and construction using single line
-                possible_audio_channels = str(' '.join(re_extract_channels[:mid_pos] + ["."] + re_extract_channels[mid_pos:]).replace(" ", ""))
-                # Now check if the regex match is in a list of common channel layouts
-                if possible_audio_channels in ['1.0', '2.0', '5.1', '7.1']:
-                    # It is! So return the regex match and skip over the ffprobe process below
-                    logging.info(f"Used regex to identify audio channels: {possible_audio_channels}")
-                    return possible_audio_channels
-
-        # If the regex failed ^^ (Likely) then we use ffprobe to try and auto detect the channels
-        audio_info_probe = FFprobe(
-            inputs={parse_me: None},
-            global_options=[
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-select_streams a:0',
-                '-show_format', '-show_streams']
-        ).run(stdout=subprocess.PIPE)
-
-        audio_info = json.loads(audio_info_probe[0].decode('utf-8'))
-        for stream in audio_info["streams"]:
-
-            if "channel_layout" in stream:  # make sure 'channel_layout' exists first (on some amzn webdls it doesn't)
+        # First try detecting the 'audio_channels' using regex (only super common channel layouts are matched e.g.  7.1  |  5.1  |  2.0  etc)
+        if release_name.audio_channels is not None:
+            # It is! So return the regex match and skip over the ffprobe process below
+            logging.info(f"Used regex to identify audio channels: {release_name.audio_channels}")
+            return release_name.audio_channels
+
+        # If the regex failed ^^ (Likely) then we use ffprobe to try and auto detect the channels (first audio stream)
+        ffprobe_audio_stream = media_probe.ffprobe_audio_stream
+        if ffprobe_audio_stream is not None:
+
+            if "channel_layout" in ffprobe_audio_stream:  # make sure 'channel_layout' exists first (on some amzn webdls it doesn't)
 
                 # convert the words 'mono, stereo, quad' to work with regex below
                 ffmpy_channel_layout_translation = {'mono': '1.0', 'stereo': '2.0', 'quad': '4.0'}
-                if str(stream["channel_layout"]) in ffmpy_channel_layout_translation.keys():
-                    stream["channel_layout"] = ffmpy_channel_layout_translation[stream["channel_layout"]]
+                channel_layout = ffmpy_channel_layout_translation.get(str(ffprobe_audio_stream["channel_layout"]), ffprobe_audio_stream["channel_layout"])
 
                 # Make sure what we got back from the ffprobe search fits into the audio_channels 'format' (num.num)
-                audio_channel_layout = re.search(r'\d\.\d', str(stream["channel_layout"]).replace("(side)", ""))
+                audio_channel_layout = re.search(r'\d\.\d', str(channel_layout).replace("(side)", ""))
                 if audio_channel_layout is not None:
                     audio_channels_ff = str(audio_channel_layout.group())
                     logging.info(f"Used ffmpy.ffprobe to identify audio channels: {audio_channels_ff}")
@@ -649,16 +651,11 @@ def analyze_video_file(missing_value):
 
         # This regex is mainly for bluray_discs
         # TODO rewrite this to be more inclusive of other audio codecs
-        bluray_disc_audio_codec_regex = re.search(r'(?P<TrueHD>TrueHD)|(?P<DTSHDMA>DTS-HD.MA)', torrent_info["raw_file_name"].replace(".", " "), re.IGNORECASE)
-        if bluray_disc_audio_codec_regex is not None:
-            for audio_codec in ["TrueHD", "DTSHDMA"]:
-                # Yeah I've kinda given up here, this is mainly to avoid mediainfo running on full bluray discs since TrueHD is really just AC3 which historically I assumed was Dolby Digital...
-                #  Don't really wanna deal with that ^^ so we try to match the 2 most popular Bluray Disc audio codecs (DTS-HD.MA & TrueHD) and move on
-                if bluray_disc_audio_codec_regex.group(audio_codec) is not None:
-                    if audio_codec == "DTSHDMA":
-                        audio_codec = "DTS-HD MA"
-                    logging.info(f'Used regex to identify the audio codec: {audio_codec}')
-                    return audio_codec
+        # Yeah I've kinda given up here, this is mainly to avoid mediainfo running on full bluray discs since TrueHD is really just AC3 which historically I assumed was Dolby Digital...
+        #  Don't really wanna deal with that ^^ so we try to match the 2 most popular Bluray Disc audio codecs (DTS-HD.MA & TrueHD) and move on
+        if release_name.bluray_disc_audio_codec is not None:
+            logging.info(f'Used regex to identify the audio codec: {release_name.bluray_disc_audio_codec}')
+            return release_name.bluray_disc_audio_codec
 
         # Now we try to identify the audio_codec using pymediainfo
         if media_info_audio_track is not None:
@@ -702,25 +699,15 @@ def analyze_video_file(missing_value):
             if "DTS" in audio_codec:
                 # DTS audio is a bit "special" and has a few possible profiles so we deal with that here
                 # We'll first try to extract it all via regex, should that fail we can use ffprobe
-                match_dts_audio = re.search(r'DTS(-HD(.MA\.)|-ES\.|(.x\.|x\.)|(.HD\.|HD\.)|)', torrent_info["raw_file_name"].replace(" ", "."), re.IGNORECASE)
-                if match_dts_audio is not None:
-                    logging.info(f'Used (pymediainfo + regex) to identify the audio codec: {str(match_dts_audio.group()).upper().replace(".", " ")}')
-                    return str(match_dts_audio.group()).upper().replace(".", " ").strip()
+                if release_name.dts_audio_codec is not None:
+                    logging.info(f'Used (pymediainfo + regex) to identify the audio codec: {release_name.dts_audio_codec}')
+                    return release_name.dts_audio_codec
 
                 # If the regex failed we can try ffprobe
-                audio_info_probe = FFprobe(
-                    inputs={parse_me: None},
-                    global_options=[
-                        '-v', 'quiet',
-                        '-print_format', 'json',
-                        '-select_streams a:0',
-                        '-show_format', '-show_streams']
-                ).run(stdout=subprocess.PIPE)
-                audio_info = json.loads(audio_info_probe[0].decode('utf-8'))
-
-                for stream in audio_info["streams"]:
-                    logging.info(f'Used ffprobe to identify the audio codec: {stream["profile"]}')
-                    return stream["profile"]
+                ffprobe_audio_stream = media_probe.ffprobe_audio_stream
+                if ffprobe_audio_stream is not None:
+                    logging.info(f'Used ffprobe to identify the audio codec: {ffprobe_audio_stream["profile"]}')
+                    return ffprobe_audio_stream["profile"]
 
             if audio_codec in audio_codec_dict.keys():
                 # Now its a bit of a Hail Mary and we try to match whatever pymediainfo returned to our audio_codec_dict/translation
@@ -750,27 +737,9 @@ def analyze_video_file(missing_value):
     if missing_value == "video_codec":
 
         # First try to use our own Regex to extract it, if that fails then we can ues ffprobe/mediainfo
-        filename_video_codec_regex = re.search(r'(?P<HEVC>HEVC)|(?P<AVC>AVC)|'
-                                               r'(?P<H265>H(.265|265))|'
-                                               r'(?P<H264>H(.264|264))|'
-                                               r'(?P<x265>x265)|(?P<x264>x264)|'
-                                               r'(?P<MPEG2>MPEG(-2|2))|'
-                                               r'(?P<VC1>VC(-1|1))', torrent_info["raw_file_name"], re.IGNORECASE)
-
-        if filename_video_codec_regex is not None:
-            rename_codec = {'VC1': 'VC-1', 'MPEG2': 'MPEG-2', 'H264': 'H.264', 'H265': 'H.265'}
-
-            for video_codec in ["HEVC", "AVC", "H265", "H264", "x265", "x264", "MPEG2", "VC1"]:
-                if filename_video_codec_regex.group(video_codec) is not None:
-                    # Now check to see if the 'codec' is in the rename_codec dict we created earlier
-                    if video_codec in rename_codec.keys():
-                        regex_video_codec = rename_codec[video_codec]
-                    else:
-                        # if this executes its AVC/HEVC or x265/x264
-                        regex_video_codec = video_codec
-
-                    logging.info(f"Used regex to identify the video_codec: {regex_video_codec}")
-                    return regex_video_codec
+        if release_name.video_codec is not None:
+            logging.info(f"Used regex to identify the video_codec: {release_name.video_codec}")
+            return release_name.video_codec
 
         # If the regex didn't work and the code has reached this point, we will now try pymediainfo
 
@@ -820,20 +789,14 @@ def identify_miscellaneous_details():
     if torrent_info["source"] == "SDTV" or torrent_info["source"] == "PDTV":
         torrent_info["source_type"] = str(torrent_info["source"].lower())
 
+    # All the regex in this function was already run on the filename when we analyzed the release name, we just read the results here
+    release_name = media_analysis["release_name"]
+
     # ------ Specific Source info ------ #
     if "source_type" not in torrent_info:
-        match_source = re.search(r'(?P<bluray_remux>.*blu(.ray|ray).*remux.*)|'
-                                 r'(?P<bluray_disc>.*blu(.ray|ray)((?!x(264|265)|h.(265|264)).)*$)|'
-                                 r'(?P<webrip>.*web(.rip|rip).*)|'
-                                 r'(?P<webdl>.*web(.dl|dl|).*)|'
-                                 r'(?P<bluray_encode>.*blu(.ray|ray).*|x(264|265)|h.(265|264))|'
-                                 r'(?P<dvd>HD(.DVD|DVD)|.*DVD.*)|'
-                                 r'(?P<hdtv>.*HDTV.*)', torrent_info["raw_file_name"], re.IGNORECASE)
-        if match_source is not None:
-            for source_type in ["bluray_disc", "bluray_remux", "bluray_encode", "webdl", "webrip", "dvd", "hdtv"]:
-                if match_source.group(source_type) is not None:
-                    # add it directly to the torrent_info dict
-                    torrent_info["source_type"] = source_type
+        if release_name.source_type is not None:
+            # add it directly to the torrent_info dict
+            torrent_info["source_type"] = release_name.source_type
 
         # Well firstly if we got this far with auto_mode enabled that means we've somehow figured out the 'parent' source but now can't figure out its 'final form'
         # If auto_mode is disabled we can prompt the user
@@ -872,87 +835,54 @@ def identify_miscellaneous_details():
 
     # ------ WEB streaming service stuff here ------ #
     if torrent_info["source"] == "Web":
-        # You can add more streaming platforms here, just append the sites 'tag' to the regex below (Case sensitive)
-        match_web_source = re.search(r'NF|AMZN|iT|ATVP|DSNP|HULU|VUDU|HMAX|iP|CBS|ESPN|STAN|STARZ|NBC|PCOK', torrent_info["raw_file_name"])
-        if match_web_source is not None:
-            torrent_info["web_source"] = match_web_source.group()
-            logging.info(f'Used Regex to extract the WEB Source: {match_web_source.group()}')
+        # You can add more streaming platforms to the 'web_source_regex' in release_name.py
+        if release_name.web_source is not None:
+            torrent_info["web_source"] = release_name.web_source
+            logging.info(f'Used Regex to extract the WEB Source: {release_name.web_source}')
 
     # --- Custom & extra info --- #
     # some torrents have 'extra' info in the title like 'repack', 'DV', 'UHD', 'Atmos', 'remux', etc
     # We simply use regex for this and will add any matches to the dict 'torrent_info', later when building the final title we add any matches (if they exist) into the title
 
     # repacks
-    match_repack = re.search(r'RERIP|REPACK|PROPER', torrent_info["raw_file_name"], re.IGNORECASE)
-    if match_repack is not None:
-        torrent_info["repack"] = match_repack.group()
-        logging.info(f'Used Regex to extract: [bold]{match_repack.group()}[/bold] from the filename')
+    if release_name.repack is not None:
+        torrent_info["repack"] = release_name.repack
+        logging.info(f'Used Regex to extract: [bold]{release_name.repack}[/bold] from the filename')
 
     # --- Bluray disc type --- #
     if torrent_info["source_type"] == "bluray_disc":
         # This is just based on resolution & size so we just match that info up to the key we create below
         possible_types = [25, 50, 66, 100]
         bluray_prefix = 'uhd' if torrent_info["screen_size"] == "2160p" else 'bd'
-        total_size = sum(f.stat().st_size for f in Path(torrent_info["upload_media"]).glob('**/*') if f.is_file())
+        total_size = get_tree_manifest().total_size
 
         for possible_type in possible_types:
             if total_size < int(possible_type * 1000000000):
                 torrent_info["bluray_disc_type"] = str(f'{bluray_prefix}_{possible_type}')
                 break
 
-    # Bluray disc regions
-    bluray_region = {
-        "USA": "USA",
-        "FRE": "FRE",
-        "GBR": "GBR",
-        "GER": "GER",
-        "CZE": "CZE",
-        "EUR": "EUR",
-        "CAN": "CAN",
-        "TWN": "TWN",
-        "AUS": "AUS",
-        "BRA": "BRA",
-        "ITA": "ITA",
-        "ESP": "ESP",
-        "HKG": "HKG",
-        "JPN": "JPN",
-        "NOR": "NOR",
-        "FRA": "FRA",
-    }
-
     # Try to split the torrent title and match a few key words
-    # End user can add their own 'key_words' that they might want to extract and add to the final torrent title
-    key_words = {'remux': 'REMUX', 'hdr': 'HDR', 'uhd': 'UHD', 'hybrid': 'Hybrid', 'atmos': 'Atmos'}
-
-    hdr_hybrid_remux_keyword_search = str(torrent_info["raw_file_name"]).replace(" ", ".").replace("-", ".").split(".")
-
-    for word in hdr_hybrid_remux_keyword_search:
-        if str(word).lower() in key_words.keys():
-            logging.info(f"extracted the key_word: {word.lower()} from the filename")
-            torrent_info[str(word).lower()] = key_words[str(word).lower()]
-
-        # Bluray region source
-        if "disc" in torrent_info["source_type"]:
-            # This is either a bluray or dvd disc, these usually have the source region in the filename, try to extract it now
-            if str(word).upper() in bluray_region.keys():
-                torrent_info["region"] = str(word).upper()
-
-        # Dolby vision (filename detection)
-        if any(x in str(word).lower() for x in ['dv', 'dovi']):
-            logging.info("Detected Dolby Vision from the filename")
-            torrent_info["dv"] = "DV"
-
-    # use regex (sourced and slightly modified from official radarr repo) to find torrent editions (Extended, Criterion, Theatrical, etc)
-    # https://github.com/Radarr/Radarr/blob/5799b3dc4724dcc6f5f016e8ce4f57cc1939682b/src/NzbDrone.Core/Parser/Parser.cs#L21
-    try:
-        torrent_editions = re.search(
-            r"((Recut.|Extended.|Ultimate.|Criterion.|International.)?(Director.?s|Collector.?s|Theatrical|Ultimate|Final|Criterion|International(?=(.(Cut|Edition|Version|Collection)))|Extended|Rogue|Special|Despecialized|\d{2,3}(th)?.Anniversary)(.(Cut|Edition|Version|Collection))?(.(Extended|Uncensored|Remastered|Unrated|Uncut|IMAX|Fan.?Edit))?|(Uncensored|Remastered|Unrated|Uncut|IMAX|Fan.?Edit|Edition|Restored|(234)in1))",
-            torrent_info["upload_media"])
-        torrent_info["edition"] = str(torrent_editions.group()).replace(".", " ")
+    # End user can add their own 'key_words' that they might want to extract and add to the final torrent title (see 'key_words' in release_name.py)
+    for key_word, key_word_value in release_name.key_words:
+        logging.info(f"extracted the key_word: {key_word} from the filename")
+        torrent_info[key_word] = key_word_value
+
+    # Bluray region source
+    if "disc" in torrent_info["source_type"] and release_name.region is not None:
+        # This is either a bluray or dvd disc, these usually have the source region in the filename
+        torrent_info["region"] = release_name.region
+
+    # Dolby vision (filename detection)
+    if release_name.dv:
+        logging.info("Detected Dolby Vision from the filename")
+        torrent_info["dv"] = "DV"
+
+    # torrent editions (Extended, Criterion, Theatrical, etc)
+    if release_name.edition is not None:
+        torrent_info["edition"] = release_name.edition
         logging.info(f"extracted '{torrent_info['edition']}' as the 'edition' for the final torrent name")
-    except AttributeError:
+    else:
         logging.info("No custom 'edition' found for this torrent")
-        pass
 
     # --------- Fix scene group tags --------- #
     # Scene releases after they unrared are all lowercase (usually) so we fix the torrent title here (Never rename the actual file)
@@ -975,11 +905,8 @@ def identify_miscellaneous_details():
         torrent_info["sd"] = 1
 
     # Use mediainfo to check if there is an atmos layer in the audio track
-    media_info = MediaInfo.parse(torrent_info["raw_video_file"] if "raw_video_file" in torrent_info else torrent_info["upload_media"])
-    for track in media_info.tracks:
-        if track.track_type == 'Audio':
-            if "JOC" in [track.other_format, track.format_additionalfeatures]:
-                torrent_info["atmos"] = "Atmos"
+    if get_media_probe().has_atmos:
+        torrent_info["atmos"] = "Atmos"
 
 
 def search_tmdb_for_id(query_title, year, content_type):
@@ -1258,55 +1185,69 @@ def format_title(json_config):
 #                       generate/edit .torrent file                      #
 # ---------------------------------------------------------------------- #
 
-def generate_callback(torrent, filepath, pieces_done, pieces_total):
-    calculate_percentage = 100 * float(pieces_done) / float(pieces_total)
-    print_progress_bar(calculate_percentage, 100, prefix='Creating .torrent file:', suffix='Complete', length=30)
-
-
-def print_progress_bar(iteration, total, prefix='', suffix='', decimals=1, length=100, fill='█', print_end="\r"):
-    percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
-    filled_length = int(length * iteration // total)
-    bar = fill * filled_length + '-' * (length - filled_length)
-    print(f'\r{prefix} |{bar}| {percent}% {suffix}', end=print_end)
-    # Print New Line on Complete
-    if iteration == total:
-        print()
-
-
-def generate_dot_torrent(media, announce, source, callback=None):
+def get_source_torrent():
+    # The .torrent the client downloaded this upload with (-source_torrent or -infohash + 'rtorrent_session_dir' in config.env), None if we don't have one
+    if args.source_torrent:
+        if os.path.isfile(args.source_torrent[0]):
+            return args.source_torrent[0]
+        logging.error(f"The source .torrent {args.source_torrent[0]} does not exist")
+    elif args.infohash:
+        return find_session_torrent(session_dir=os.getenv('rtorrent_session_dir'), infohash=args.infohash[0])
+    return None
+
+
+def start_dot_torrent_hashing():
+    # Start hashing the upload in the background (see torrent_hashing.py), generate_dot_torrent() waits for it
+    # While the background bdinfo scan is running its report (BDINFO.<name>.txt) is written inside the disc folder, make sure it never ends up in the .torrent
+    exclude_globs = []
+    if args.disc:
+        exclude_globs.append(f'{glob.escape(os.path.basename(os.path.normpath(torrent_info["upload_media"])))}/BDINFO.*.txt')
+
+    # The hashing thread reports its progress here, we only show it if we end up waiting for it
+    media_analysis["torrent_hashing_progress"] = hashing_progress = {}
+    media_analysis["torrent_hashing_stop"] = threading.Event()
+    media_analysis["torrent_hashing"] = start_torrent_hashing(
+        media=torrent_info["upload_media"], exclude_globs=exclude_globs, piece_hash_store=piece_hash_store, manifest=get_tree_manifest(), source_torrent=get_source_torrent(),
+        callback=lambda torrent, filepath, pieces_done, pieces_total: hashing_progress.update(pieces_done=pieces_done, pieces_total=pieces_total),
+        stop_event=media_analysis["torrent_hashing_stop"]
+    )
+    logging.info(f'Started hashing {torrent_info["upload_media"]} in the background')
+
+
+def cancel_dot_torrent_hashing():
+    # Stop hashing if we don't need the .torrent anymore (skipped upload, every tracker was skipped) & wait for the hashing thread to let go of the files
+    if "torrent_hashing" in media_analysis:
+        media_analysis["torrent_hashing_stop"].set()
+        media_analysis["torrent_hashing"].cancel()
+        wait([media_analysis["torrent_hashing"]])
+
+
+def wait_for_torrent_hashing():
+    # Returns the hashed Torrent (without an announce url & source), shows the hashing progress if it isn't done yet
+    torrent_hashing = media_analysis["torrent_hashing"]
+    if not torrent_hashing.done():
+        hashing_progress = media_analysis["torrent_hashing_progress"]
+        with Progress(console=console, transient=True) as progress:
+            hashing_task = progress.add_task("Hashing .torrent pieces...", total=None)
+            while not torrent_hashing.done():
+                if hashing_progress:
+                    progress.update(hashing_task, completed=hashing_progress["pieces_done"], total=hashing_progress["pieces_total"])
+                time.sleep(0.5)
+    return torrent_hashing.result()
+
+
+def generate_dot_torrent(tracker, announce, source):
+    # The hashed torrent stays in memory (the background hashing result), every tracker gets its own bencoded copy with its announce url & source
+    # Those bytes are what we upload (upload_to_site) & they're only written to the disk if 'dot_torrent_move_location' is set
     logging.info("Creating the .torrent file now")
     logging.info("announce url: {}".format(announce[0]))
-    if len(glob.glob(working_folder + "/temp_upload/*.torrent")) == 0:
-        logging.info("Existing .torrent file does not exist so we need to generate a new one")
-        # we need to actually generate a torrent file "from scratch"
-        torrent = Torrent(media,
-                          trackers=announce,
-                          source=source,
-                          private=True,
-                          )
-
-        torrent.generate(callback=callback)
-        torrent.write(f'{working_folder}/temp_upload/{tracker}-{torrent_info["torrent_title"]}.torrent')
-        # Save the path to .torrent file in torrent_settings
-        torrent_info["dot_torrent"] = f'{working_folder}/temp_upload/{torrent_info["torrent_title"]}.torrent'
-        logging.info("Trying to write into {}".format("[" + source + "]" + torrent_info["torrent_title"] + ".torrent"))
-
-    else:
-        print("Editing previous .torrent file to work with {} instead of generating a new one".format(source))
-        logging.info("Editing previous .torrent file to work with {} instead of generating a new one".format(source))
-
-        edit_torrent = Torrent.read(glob.glob(working_folder + '/temp_upload/*.torrent')[0])  # just choose whichever, doesn't really matter since we replace the same info anyways
-
-        edit_torrent.metainfo['announce'] = announce[0]
-        edit_torrent.metainfo['info']['source'] = source
-        edit_torrent.metainfo['comment'] = ""
-        # Edit the previous .torrent and save it as a new copy
-        Torrent.copy(edit_torrent).write(f'{working_folder}/temp_upload/{tracker}-{torrent_info["torrent_title"]}.torrent')
+    torrent = wait_for_torrent_hashing()
+    torrent.trackers = announce
+    torrent.source = source
 
-    if os.path.isfile(f'{working_folder}/temp_upload/{tracker}-{torrent_info["torrent_title"]}.torrent'):
-        logging.info(f'Successfully created the following file: {working_folder}/temp_upload/{tracker}-{torrent_info["torrent_title"]}.torrent')
-    else:
-        logging.error(f'The following .torrent file was not created: {working_folder}/temp_upload/{tracker}-{torrent_info["torrent_title"]}.torrent')
+    torrent_info["dot_torrent"] = f'{tracker}-{torrent_info["torrent_title"]}.torrent'
+    media_analysis.setdefault("dot_torrents", {})[torrent_info["dot_torrent"]] = torrent.dump()
+    logging.info(f'Created {torrent_info["dot_torrent"]} ({torrent.infohash})')
 
 
 # ---------------------------------------------------------------------- #
@@ -1398,11 +1339,9 @@ def choose_right_tracker_keys():
 
                 # the torrent file is always submitted as a file
                 if required_value == "file":
+                    # For the .torrent this is the file name of this trackers copy (its content is in media_analysis["dot_torrents"])
                     if translation_key in torrent_info:
                         tracker_settings[config["translation"][translation_key]] = torrent_info[translation_key]
-                    # Make sure you select the right .torrent file
-                    if translation_key == "dot_torrent":
-                        tracker_settings[config["translation"]["dot_torrent"]] = f'{working_folder}/temp_upload/{tracker}-{torrent_info["torrent_title"]}.torrent'
 
 
 
@@ -1545,7 +1484,11 @@ def upload_to_site(upload_to, tracker_api_key):
 
         # Now that we know if we are looking for a required or optional key we can try to add it into the payload
         if str(config[req_opt][key]) == "file":
-            if os.path.isfile(tracker_settings['{}'.format(key)]):
+            if key == config["translation"].get("dot_torrent") and val in media_analysis.get("dot_torrents", {}):
+                # The .torrent is only in memory, send its bytes with the file name the tracker should see
+                files.append((key, (val, media_analysis["dot_torrents"][val], 'application/x-bittorrent')))
+                display_files[key] = val
+            elif os.path.isfile(tracker_settings['{}'.format(key)]):
                 post_file = f'{key}', open(tracker_settings[f'{key}'], 'rb')
                 files.append(post_file)
                 display_files[key] = tracker_settings[f'{key}']
@@ -1554,7 +1497,10 @@ def upload_to_site(upload_to, tracker_api_key):
                 continue
         else:
             # if str(val).endswith(".nfo") or str(val).endswith(".txt"):
-            if str(val).endswith(".txt"):
+            if key == config["translation"].get("mediainfo") and "mediainfo_report" in media_analysis:
+                # mediainfo.txt (or the bdinfo report) is already in memory, no need to read it back from the disk
+                val = media_analysis["mediainfo_report"]
+            elif str(val).endswith(".txt"):
                 if not os.path.exists(val):
                     create_file = open(val, "w+")
                     create_file.close()
@@ -1598,7 +1544,7 @@ def upload_to_site(upload_to, tracker_api_key):
             return
 
     logging.info("Payload for {site} is {payload}".format(site=upload_to, payload=payload))
-    logging.info("Files for {site} is {files}".format(site=upload_to, files=files))
+    logging.info("Files for {site} is {files}".format(site=upload_to, files=display_files))
 
     response = requests.request("POST", url, data=payload, files=files)
     logging.info(f"POST Request: {url}")
@@ -1772,11 +1718,14 @@ else:
     for arg_file in user_supplied_paths:
         upload_queue.append(arg_file)
 
-# Now for each file we've been supplied (batch more or just the user manually specifying multiple files) we create a loop here that uploads each of them until none are left
-for file in upload_queue:
+# Everything we do to upload 1 file/folder, the loop at the bottom calls this for every file in the upload_queue
+def upload_file(file):
+    # choose_right_tracker_keys() & upload_to_site() read the current tracker, its settings & the tracker config as globals
+    global tracker, tracker_settings, config
     # Remove all old temp_files & data from the previous upload
     delete_leftover_files()
     torrent_info.clear()
+    media_analysis.clear()
 
     # File we're uploading
     console.print(f'Uploading: [bold][blue]{file}[/blue][/bold]')
@@ -1813,7 +1762,7 @@ for file in upload_queue:
                 console.print('unrar is not installed, Unable to extract the rar archinve\n', style='bold red')
                 logging.critical('"unrar" is not installed, Unable to extract rar archive')
                 logging.info('Perhaps first try "sudo apt-get install unrar" then run this script again')
-                continue  # Skip this entire 'file upload' & move onto the next (if exists)
+                return  # Skip this entire 'file upload' & move onto the next (if exists)
 
     else:
         torrent_info["upload_media"] = file
@@ -1823,8 +1772,11 @@ for file in upload_queue:
     # So now we can start collecting info about the file/folder that was supplied to us (Step 1)
     if identify_type_and_basic_info(torrent_info["upload_media"]) == 'skip_to_next_file':
         # If there is an issue with the file & we can't upload we use this check to skip the current file & move on to the next (if exists)
-        continue
+        return
 
+    # -------- Start hashing the .torrent --------
+    # The pieces only depend on the files so now that we know we are uploading them we hash them in the background while we do everything else
+    start_dot_torrent_hashing()
 
     # Update discord channel
     if discord_url:
@@ -1897,8 +1849,7 @@ for file in upload_queue:
 
     # -------- Take / Upload Screenshots --------
 
-    media_info_duration = MediaInfo.parse(torrent_info["raw_video_file"] if "raw_video_file" in torrent_info else torrent_info["upload_media"]).tracks[1]
-    torrent_info["duration"] = str(media_info_duration.duration).split(".", 1)[0]  # This is used to evenly space out timestamps for screenshots
+    torrent_info["duration"] = get_media_probe().duration  # This is used to evenly space out timestamps for screenshots
     # Call function to actually take screenshots & upload them (different file)
     take_upload_screens(
         duration=torrent_info["duration"],
@@ -1991,12 +1942,15 @@ for file in upload_queue:
         console.print(f'\n[bold]Generating .torrent file for [chartreuse1]{tracker}[/chartreuse1][/bold]')
 
         generate_dot_torrent(
-            media=torrent_info["upload_media"],
+            tracker=tracker,
             announce=list(os.getenv(f"{str(tracker).upper()}_ANNOUNCE_URL").split(" ")),
-            source=tracker,
-            callback=generate_callback
+            source=tracker
         )
 
+        # -------- Wait for bdinfo (raw discs only) --------
+        # mediainfo.txt for discs comes from the background bdinfo scan, it needs to be finished before we can upload
+        wait_for_bdinfo_scan()
+
         # -------- Assign specific tracker keys --------
         choose_right_tracker_keys()  # This function takes the info we have the dict torrent_info and associates with the right key/values needed for us to use X trackers API
 
@@ -2019,6 +1973,9 @@ for file in upload_queue:
     # -------- Post Processing --------
     # After we upload the media we can move the .torrent & media files to a place the user specifies
     # This isn't tracker specific so its outside of that ^^ 'for loop'
+    # (If every tracker was skipped we might still be running bdinfo on the disc, let it finish before we move anything & stop hashing)
+    wait_for_bdinfo_scan()
+    cancel_dot_torrent_hashing()
 
     move_locations = {"torrent": f"{os.getenv('dot_torrent_move_location')}", "media": f"{os.getenv('media_move_location')}"}
 
@@ -2028,11 +1985,10 @@ for file in upload_queue:
             logging.info(f"The path {move_location_value} exists")
 
             if move_location_key == 'torrent':
-                # The user might have upload to a few sites so we need to move all files that end with .torrent to the new location
-                list_dot_torrent_files = glob.glob(f"{working_folder}/temp_upload/*.torrent")
-                for dot_torrent_file in list_dot_torrent_files:
-                    # Move each .torrent file we find into the directory the user specified
-                    shutil.copy(dot_torrent_file, move_locations["torrent"])
+                # The user might have upload to a few sites so we write every trackers .torrent to the new location
+                for dot_torrent_name, dot_torrent_bytes in media_analysis.get("dot_torrents", {}).items():
+                    with open(os.path.join(move_locations["torrent"], dot_torrent_name), 'wb') as dot_torrent_file:
+                        dot_torrent_file.write(dot_torrent_bytes)
 
             # Media files are moved instead of copied so we need to make sure they don't already exist in the path the user provides
             if move_location_key == 'media':
@@ -2059,3 +2015,14 @@ for file in upload_queue:
     # Update discord channel
     if discord_url:
         requests.request("POST", discord_url, headers={'Content-Type': 'application/x-www-form-urlencoded'}, data=f'content='f'Total runtime: **{total_run_time} seconds**')
+
+
+# Now for each file we've been supplied (batch more or just the user manually specifying multiple files) we create a loop here that uploads each of them until none are left
+for file in upload_queue:
+    try:
+        upload_file(file)
+    finally:
+        # However this upload ended (finished, skipped, sys.exit, an error or ctrl+c) stop anything still running in the background
+        # so we can move on to the next file (or exit) right away instead of waiting for it
+        cancel_bdinfo_scan()
+        cancel_dot_torrent_hashing()
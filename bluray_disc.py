@@ -0,0 +1,249 @@
+import os
+import re
+import signal
+import struct
+import logging
+import threading
+import subprocess
+from dataclasses import dataclass
+from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+# Everything we need to do for raw bluray disc (-disc) uploads lives here
+#
+# The main playlist is found by reading the discs .mpls/.clpi files directly, 'bdinfo -l' (list the playlists) is only used as a fallback
+# and when it is needed it only runs once per disc & its output is cached, the full bdinfo scan of the main playlist
+# takes minutes on UHD discs so we start it in the background as soon as we know the largest playlist & only wait for it right before we need the report
+
+# Only 1 disc is scanned at a time, no need for more than 1 worker
+bdinfo_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bdinfo')
+
+# The bdinfo scans that are running right now, if the upload is aborted we stop them (cancel_playlist_scan) instead of waiting minutes for them to finish
+bdinfo_processes = set()
+bdinfo_processes_lock = threading.Lock()
+
+
+# ---------------------------------------------------------------------- #
+#                 Read the .mpls & .clpi files ourselves                  #
+# ---------------------------------------------------------------------- #
+# We only need to know which playlist is the main feature (largest) & which .m2ts file to use for mediainfo/screenshots
+# That info is in the discs playlist (BDMV/PLAYLIST/*.mpls) & clip info (BDMV/CLIPINF/*.clpi) files so there's no need to start bdinfo (mono) for it
+
+# .mpls & .clpi timestamps are in 45 kHz ticks & every source packet in a .m2ts file is 192 bytes
+mpls_ticks_per_second = 45000
+m2ts_source_packet_size = 192
+
+
+@dataclass(frozen=True)
+class Playlist:
+    name: str
+    # Total length of all the play items in seconds
+    duration: float
+    # Same as the 'estimated bytes' bdinfo shows, the total size of every clip (first angle) in the playlist
+    size: int
+    # The clips (e.g. '00055') in the order they are played, this can contain the same clip more than once
+    clips: Tuple[str, ...]
+
+
+def read_clip_size(disc_path, clip):
+    # The .clpi file tells us how many source packets the clip has, if that fails we just check the size of the .m2ts file
+    try:
+        with open(os.path.join(disc_path, 'BDMV', 'CLIPINF', f'{clip}.clpi'), 'rb') as clpi:
+            clpi_data = clpi.read(60)
+        if clpi_data[:4] == b'HDMV' and len(clpi_data) >= 60:
+            # ClipInfo() always starts at byte 40, number_of_source_packets is the last field we read
+            number_of_source_packets = struct.unpack('>I', clpi_data[56:60])[0]
+            if number_of_source_packets > 0:
+                return number_of_source_packets * m2ts_source_packet_size
+    except OSError:
+        pass
+
+    m2ts_file = find_stream_file(disc_path, clip)
+    return os.path.getsize(m2ts_file) if m2ts_file else 0
+
+
+def find_stream_file(disc_path, clip):
+    # Some rips have upper case file names (00055.M2TS) so we try both
+    for extension in ('m2ts', 'M2TS'):
+        m2ts_file = os.path.join(disc_path, 'BDMV', 'STREAM', f'{clip}.{extension}')
+        if os.path.isfile(m2ts_file):
+            return m2ts_file
+    return None
+
+
+def read_mpls(mpls_file):
+    # Returns the (duration, clips) of the playlist, for multi angle play items we only use the first angle
+    with open(mpls_file, 'rb') as mpls:
+        mpls_data = mpls.read()
+    if mpls_data[:4] != b'MPLS':
+        raise ValueError(f'{mpls_file} is not a valid .mpls file')
+
+    playlist_start = struct.unpack('>I', mpls_data[8:12])[0]
+    number_of_play_items = struct.unpack('>H', mpls_data[playlist_start + 6:playlist_start + 8])[0]
+
+    duration_ticks = 0
+    clips = []
+    play_item_start = playlist_start + 10
+    for _ in range(number_of_play_items):
+        play_item_length = struct.unpack('>H', mpls_data[play_item_start:play_item_start + 2])[0]
+        clip = mpls_data[play_item_start + 2:play_item_start + 7].decode('ascii')
+        in_time, out_time = struct.unpack('>II', mpls_data[play_item_start + 14:play_item_start + 22])
+
+        clips.append(clip)
+        duration_ticks += max(out_time - in_time, 0)
+        play_item_start += 2 + play_item_length
+
+    return duration_ticks / mpls_ticks_per_second, tuple(clips)
+
+
+def read_playlists(disc_path):
+    # Returns a dict of  {playlist (e.g. 00800.MPLS): Playlist}  for every playlist on the disc we can read
+    playlist_folder = os.path.join(disc_path, 'BDMV', 'PLAYLIST')
+    if not os.path.isdir(playlist_folder):
+        return {}
+
+    clip_sizes = {}
+    playlists = {}
+    for mpls_file in sorted(os.listdir(playlist_folder)):
+        if not mpls_file.lower().endswith('.mpls'):
+            continue
+        try:
+            duration, clips = read_mpls(os.path.join(playlist_folder, mpls_file))
+        except (OSError, ValueError, struct.error, UnicodeDecodeError) as mpls_error:
+            logging.error(f"Unable to read the playlist {mpls_file}: {mpls_error}")
+            continue
+
+        for clip in clips:
+            if clip not in clip_sizes:
+                clip_sizes[clip] = read_clip_size(disc_path, clip)
+        # bdinfo shows (and expects) the playlist name in upper case
+        playlist_name = mpls_file.upper()
+        playlists[playlist_name] = Playlist(name=playlist_name, duration=duration, size=sum(clip_sizes[clip] for clip in clips), clips=clips)
+
+    logging.info(f"Read {len(playlists)} playlists from {playlist_folder}")
+    return playlists
+
+
+def find_main_stream_file(disc_path, playlist):
+    # The largest .m2ts file in the playlist is what we run mediainfo on & take screenshots from
+    stream_files = [find_stream_file(disc_path, clip) for clip in set(playlist.clips)]
+    stream_files = [stream_file for stream_file in stream_files if stream_file is not None]
+    return max(stream_files, key=os.path.getsize) if stream_files else None
+
+
+# ---------------------------------------------------------------------- #
+#                                 bdinfo                                 #
+# ---------------------------------------------------------------------- #
+def parse_playlist_listing(bdinfo_listing_output):
+    # Turn the 'bdinfo -l' output into a dict of  {playlist: estimated bytes}
+    bdinfo_output_split = str(' '.join(bdinfo_listing_output.split())).split(' ')
+    all_mpls_playlists = re.findall(r'\d\d\d\d\d\.MPLS', str(bdinfo_output_split))
+
+    dict_of_playlist_length_size = {}
+    for index, mpls_playlist in enumerate(bdinfo_output_split):
+        if mpls_playlist in all_mpls_playlists:
+            # The columns are:  playlist | length | estimated bytes | measured bytes
+            dict_of_playlist_length_size[mpls_playlist] = int(str(bdinfo_output_split[index + 2]).replace(",", ""))
+    return dict_of_playlist_length_size
+
+
+def find_largest_playlist(dict_of_playlist_length_size):
+    largest_playlist_value = max(dict_of_playlist_length_size.values())
+    return list(dict_of_playlist_length_size.keys())[list(dict_of_playlist_length_size.values()).index(largest_playlist_value)]
+
+
+def list_playlists(bdinfo_script, disc_path, cache_key_file, cache):
+    # The output of 'bdinfo -l' (list of playlists, their length & size), cached using one of the discs stream files as the key
+    bdinfo_listing_output = cache.get_or_probe(cache_key_file, "bdinfo_playlists",
+                                               lambda: str(subprocess.check_output([bdinfo_script, disc_path, "-l"])))
+    return parse_playlist_listing(bdinfo_listing_output)
+
+
+# We only upload the part of the bdinfo report that comes after this line (the 'quick summary' & forums paste are above it)
+bdinfo_forums_paste_end = '<---- END FORUMS PASTE ---->'
+
+
+def trim_bdinfo_report(bdinfo_report_lines):
+    # Drop everything up to (and including) the 'END FORUMS PASTE' line, works on any iterable of lines so the report can be streamed through it
+    bdinfo_report_lines = iter(bdinfo_report_lines)
+    for line in bdinfo_report_lines:
+        if bdinfo_forums_paste_end in line:
+            break
+    yield from bdinfo_report_lines
+
+
+def bdinfo_report_file(disc_path, raw_file_name):
+    # This is where bdinfo writes its report (inside the disc folder)
+    return f'{disc_path}BDINFO.{raw_file_name}.txt'
+
+
+def scan_playlist(bdinfo_script, disc_path, raw_file_name, playlist, save_location, cache_key_file, cache, stop_event=None):
+    # Run the full bdinfo scan on 'playlist' & save the report (only the part after the 'forums paste') to 'save_location'
+    # The trimmed report is also returned so the upload can use it without reading mediainfo.txt back in
+    cache_kind = f"bdinfo_report {playlist}"
+
+    # If we've already scanned this playlist (e.g. a retry or uploading to another tracker) we can reuse that report
+    cached_bdinfo_report = cache.get(cache_key_file, cache_kind)
+    # (older runs could have cached an empty report, those are scanned again)
+    if cached_bdinfo_report:
+        with open(save_location, 'w') as f:
+            f.write(cached_bdinfo_report)
+        return cached_bdinfo_report
+
+    logging.info(f"Starting the bdinfo scan of {playlist}")
+    # This runs in the background, we don't want bdinfo's progress output mixed in with everything else we print
+    # bdinfo gets its own process group so cancel_playlist_scan() can stop it & anything it started (e.g. docker run)
+    with bdinfo_processes_lock:
+        if stop_event is not None and stop_event.is_set():
+            return None
+        bdinfo_process = subprocess.Popen([bdinfo_script, disc_path, "--mpls=" + playlist], stdout=subprocess.DEVNULL, start_new_session=True)
+        bdinfo_processes.add(bdinfo_process)
+    try:
+        bdinfo_process.wait()
+    finally:
+        with bdinfo_processes_lock:
+            bdinfo_processes.discard(bdinfo_process)
+    if bdinfo_process.returncode < 0:
+        logging.error(f"The bdinfo scan of {playlist} was stopped")
+        return None
+
+    # Stream the report from the disc folder straight into mediainfo.txt (trimmed on the way) instead of moving it & rewriting it in place
+    bdinfo_report_lines = []
+    with open(bdinfo_report_file(disc_path, raw_file_name), 'r') as bdinfo_report, open(save_location, 'w') as f:
+        for line in trim_bdinfo_report(bdinfo_report):
+            f.write(line)
+            bdinfo_report_lines.append(line)
+    os.remove(bdinfo_report_file(disc_path, raw_file_name))
+
+    bdinfo_report_text = ''.join(bdinfo_report_lines)
+    if bdinfo_report_text:
+        cache.put(cache_key_file, cache_kind, bdinfo_report_text)
+    else:
+        # Don't cache an empty report, the next run scans the playlist again instead of uploading nothing forever
+        logging.error(f"The bdinfo report for {playlist} is empty (no '{bdinfo_forums_paste_end}' line?), it won't be cached")
+    logging.info(f"Finished the bdinfo scan of {playlist}")
+    return bdinfo_report_text
+
+
+def start_playlist_scan(**scan_playlist_kwargs):
+    # Returns a Future, call .result() on it to wait for the scan to finish (this also re-raises anything that went wrong)
+    stop_event = threading.Event()
+    playlist_scan = bdinfo_executor.submit(scan_playlist, stop_event=stop_event, **scan_playlist_kwargs)
+    playlist_scan.stop_event = stop_event
+    return playlist_scan
+
+
+def cancel_playlist_scan(playlist_scan):
+    # Stop the scan 'playlist_scan' (the Future start_playlist_scan returned) if it hasn't finished yet & wait for it to let go of the disc
+    if playlist_scan.done() or playlist_scan.cancel():
+        return
+    with bdinfo_processes_lock:
+        playlist_scan.stop_event.set()
+        for bdinfo_process in bdinfo_processes:
+            logging.info(f"Stopping the bdinfo scan (pid {bdinfo_process.pid})")
+            try:
+                os.killpg(bdinfo_process.pid, signal.SIGTERM)
+            except OSError:
+                bdinfo_process.terminate()
+    wait([playlist_scan])
@@ -0,0 +1,88 @@
+import os
+import re
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from ffmpy import FFmpeg, FFRuntimeError, FFExecutableNotFoundError
+
+# numpy is optional, without it we just use the planned timestamps
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Evenly spaced timestamps sometimes land on black frames, fades or credits
+# For each screenshot we decode a few small grayscale 'candidate' frames (the keyframes starting at the planned timestamp) in 1 ffmpeg process,
+# score them & only take the full resolution screenshot of the best one
+
+# Candidates are scaled down to this size (aspect ratio doesn't matter for scoring) so decoding & scoring them is cheap
+candidate_width, candidate_height = 160, 90
+
+showinfo_pts_time_regex = re.compile(r'Parsed_showinfo.*?pts_time:\s*(-?[\d.]+)')
+
+
+def get_number_of_candidates():
+    # 'screenshot_candidates' in config.env, 0 or 1 turns this off
+    number_of_candidates = os.getenv('screenshot_candidates', '0')
+    return int(number_of_candidates) if str(number_of_candidates).isdigit() else 0
+
+
+def score_frame(frame):
+    # Higher is better, frames with detail (edges) & contrast win. Black/white frames, fades & mostly flat frames get pushed to the bottom
+    luma = frame.astype(numpy.float32)
+    mean_luma = luma.mean()
+    contrast = luma.std()
+    edge_energy = numpy.abs(numpy.diff(luma, axis=1)).mean() + numpy.abs(numpy.diff(luma, axis=0)).mean()
+
+    score = contrast * edge_energy
+    if mean_luma < 20 or mean_luma > 235 or contrast < 12:
+        score *= 0.01
+    return score
+
+
+def decode_candidates(upload_media, ss_timestamp, number_of_candidates):
+    # Returns a list of (timestamp, frame) for up to 'number_of_candidates' keyframes starting at 'ss_timestamp'
+    ffmpeg_output = FFmpeg(
+        inputs={upload_media: ['-loglevel', 'info', '-skip_frame', 'nokey', '-ss', f'{ss_timestamp:.6f}']},
+        outputs={'-': ['-vf', f'scale={candidate_width}:{candidate_height},format=gray,showinfo', '-vsync', '0', '-frames:v', str(number_of_candidates), '-f', 'rawvideo']}
+    ).run(stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    frame_size = candidate_width * candidate_height
+    raw_frames, ffmpeg_log = ffmpeg_output[0], ffmpeg_output[1].decode('utf-8', errors='replace')
+    # showinfo timestamps start at 0 from where we seeked to
+    pts_times = [float(pts_time) for pts_time in showinfo_pts_time_regex.findall(ffmpeg_log)]
+
+    candidates = []
+    for index, pts_time in enumerate(pts_times[:len(raw_frames) // frame_size]):
+        frame = numpy.frombuffer(raw_frames[index * frame_size:(index + 1) * frame_size], dtype=numpy.uint8).reshape(candidate_height, candidate_width)
+        candidates.append((round(ss_timestamp + max(pts_time, 0), 6), frame))
+    return candidates
+
+
+def pick_best_frame(upload_media, ss_timestamp, next_ss_timestamp, number_of_candidates):
+    # Returns the timestamp of the best candidate frame for this screenshot (never at/after the next screenshot)
+    try:
+        candidates = decode_candidates(upload_media=upload_media, ss_timestamp=ss_timestamp, number_of_candidates=number_of_candidates)
+    except (FFRuntimeError, FFExecutableNotFoundError, ValueError) as ffmpeg_error:
+        logging.error(f'Failed to decode the candidate frames at {ss_timestamp}: {ffmpeg_error}')
+        return ss_timestamp
+
+    candidates = [(timestamp, frame) for timestamp, frame in candidates if next_ss_timestamp is None or timestamp < next_ss_timestamp]
+    if not candidates:
+        return ss_timestamp
+    scores = [(score_frame(frame), timestamp) for timestamp, frame in candidates]
+    best_score, best_timestamp = max(scores)
+    logging.info(f'Screenshot candidates at {ss_timestamp}: {[(timestamp, round(float(score), 1)) for score, timestamp in scores]}, using {best_timestamp}')
+    return best_timestamp
+
+
+def pick_best_frames(upload_media, ss_timestamps, number_of_candidates, workers):
+    # 'ss_timestamps' are the planned (sorted) screenshot timestamps, returns the timestamp we should actually take each screenshot at
+    if numpy is None:
+        logging.error('screenshot_candidates is set but numpy is not installed, using the planned timestamps')
+        return ss_timestamps
+    next_ss_timestamps = list(ss_timestamps[1:]) + [None]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='screenshot_candidates') as candidate_executor:
+        return list(candidate_executor.map(lambda timestamps: pick_best_frame(upload_media, timestamps[0], timestamps[1], number_of_candidates),
+                                           zip(ss_timestamps, next_ss_timestamps)))
@@ -0,0 +1,77 @@
+import time
+import logging
+from sqlite_cache import SqliteCache
+
+
+# Keeps track of how each image host has been doing (upload time, failures & images that were too big for it) across runs
+# so we can try the fastest/most reliable host first instead of always going img_host_1 -> img_host_2 -> ...
+#
+# Every batch we upload to a host is 1 row, only the last 'window' batches of each host count
+# A host that fails 'failure_threshold' batches in a row is skipped for 'cooldown_minutes' (circuit breaker), after that it gets 1 more try
+# & if that fails too it's skipped again right away
+class ImgHostStats(SqliteCache):
+    # Hosts that fail a whole batch cost us roughly this long per image (waiting for the failure before we can retry on the next host)
+    failure_cost_seconds = 30
+
+    def __init__(self, db_path, window=50, failure_threshold=3, cooldown_minutes=15, min_batches=3):
+        self.window = int(window)
+        self.failure_threshold = int(failure_threshold)
+        self.cooldown_seconds = float(cooldown_minutes) * 60
+        # Hosts with fewer batches than this keep their img_host_N position
+        self.min_batches = int(min_batches)
+        super().__init__(db_path, schema=[
+            "CREATE TABLE IF NOT EXISTS batches ("
+            "img_host TEXT, recorded REAL, images INTEGER, uploaded INTEGER, seconds REAL, size_rejections INTEGER)",
+            "CREATE INDEX IF NOT EXISTS batches_img_host ON batches (img_host, recorded)",
+            "CREATE TABLE IF NOT EXISTS breakers (img_host TEXT PRIMARY KEY, consecutive_failures INTEGER, tripped_until REAL)"])
+
+    def record(self, img_host, images, uploaded, seconds, size_rejections=0):
+        # 'images' is how many we sent to the host & 'uploaded' how many came back with a link
+        # 'size_rejections' are the screenshots we couldn't send at all because they're over the hosts size limit
+        with self._locked_connection() as conn:
+            conn.execute("INSERT INTO batches VALUES (?, ?, ?, ?, ?, ?)", (img_host, time.time(), images, uploaded, seconds, size_rejections))
+            # Only keep the last 'window' batches for each host
+            conn.execute("DELETE FROM batches WHERE img_host=? AND rowid NOT IN (SELECT rowid FROM batches WHERE img_host=? ORDER BY recorded DESC LIMIT ?)",
+                         (img_host, img_host, self.window))
+
+            if images == 0:
+                # Nothing was sent (everything was too big), that doesn't say anything about the host being up or down
+                return
+            row = conn.execute("SELECT consecutive_failures FROM breakers WHERE img_host=?", (img_host,)).fetchone()
+            consecutive_failures = 0 if uploaded > 0 else (row[0] if row else 0) + 1
+            tripped_until = time.time() + self.cooldown_seconds if consecutive_failures >= self.failure_threshold else 0
+            conn.execute("INSERT OR REPLACE INTO breakers VALUES (?, ?, ?)", (img_host, consecutive_failures, tripped_until))
+        if tripped_until:
+            logging.error(f'{img_host} failed {consecutive_failures} times in a row, skipping it for the next {self.cooldown_seconds / 60:g} minutes')
+
+    def is_tripped(self, img_host):
+        with self._locked_connection() as conn:
+            row = conn.execute("SELECT tripped_until FROM breakers WHERE img_host=?", (img_host,)).fetchone()
+        return row is not None and row[0] > time.time()
+
+    def expected_cost(self, img_host):
+        # Roughly how many seconds it takes to get 1 screenshot onto this host (failed & rejected uploads make it more expensive), None if we don't know the host well enough yet
+        with self._locked_connection() as conn:
+            batches, images, uploaded, seconds, size_rejections = conn.execute(
+                "SELECT COUNT(*), SUM(images), SUM(uploaded), SUM(seconds), SUM(size_rejections) FROM batches WHERE img_host=?", (img_host,)).fetchone()
+        if batches < self.min_batches or not images:
+            return None
+        error_rate = 1 - uploaded / images
+        size_rejection_rate = size_rejections / (images + size_rejections)
+        latency = seconds / images
+        return (latency + error_rate * self.failure_cost_seconds) / max(1 - size_rejection_rate, 0.05)
+
+    def order_hosts(self, enabled_img_hosts_list):
+        # Returns the hosts in the order we should try them, hosts we have enough stats for are sorted by their expected cost
+        # (they swap places with each other) while new hosts keep their img_host_N position. Tripped hosts are left out unless every host is tripped
+        available_hosts = [img_host for img_host in enabled_img_hosts_list if not self.is_tripped(img_host)]
+        if not available_hosts:
+            logging.error(f'Every image host is cooling down after failing, trying them anyways: {enabled_img_hosts_list}')
+            return list(enabled_img_hosts_list)
+
+        host_costs = {img_host: self.expected_cost(img_host) for img_host in available_hosts}
+        known_hosts = iter(sorted((img_host for img_host in available_hosts if host_costs[img_host] is not None), key=host_costs.get))
+        ordered_hosts = [next(known_hosts) if host_costs[img_host] is not None else img_host for img_host in available_hosts]
+        if ordered_hosts != list(enabled_img_hosts_list):
+            logging.info(f'Image host order based on their stats: {ordered_hosts} (expected seconds per screenshot: {host_costs})')
+        return ordered_hosts
@@ -0,0 +1,202 @@
+import os
+import zlib
+import struct
+import logging
+from ffmpy import FFmpeg
+from concurrent.futures import ThreadPoolExecutor
+
+# numpy is optional, without it we can only try different zlib settings (ffmpeg already picked the row filters)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# ffmpeg writes screenshots with a fast zlib level & no row filters, they're way too big to upload like that (4K frames can go over imgbox's 10 MB limit)
+# so we recompress them here (lossless), trying each PNG row filter & a few zlib strategies and keeping whatever is smallest
+# If an image is still too big for an image host we make a lossy copy (jpg/webp) just for that host
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+# Bytes per pixel for each PNG color type (at 8 bits per channel)
+png_color_type_channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
+# PNG row filter types
+png_filters = {'none': 0, 'sub': 1, 'up': 2, 'average': 3, 'paeth': 4}
+
+# zlib strategies we try on every screenshot
+zlib_strategies = (zlib.Z_DEFAULT_STRATEGY, zlib.Z_FILTERED, zlib.Z_RLE)
+
+# Default upload limits for each image host (bytes), can be changed with '<img_host>_max_size_mb' in config.env
+img_host_size_limits = {'imgbox': 10485760, 'imgbb': 33554432, 'freeimage': 67108864}
+
+
+def ffmpeg_png_options():
+    # If we are going to recompress the screenshot anyways there's no point in ffmpeg spending time on it
+    # '-q:v' doesn't do anything for png, the png encoder only has a zlib level & the row filter ('pred')
+    if screenshot_optimization_enabled() and numpy is not None:
+        return '-compression_level 1 -pred none'
+    return '-pred mixed'
+
+
+def screenshot_optimization_enabled():
+    return str(os.getenv('optimize_screenshots', 'true')).lower() != 'false'
+
+
+def read_png_chunks(png_data):
+    if not png_data.startswith(png_signature):
+        raise ValueError('Not a png file')
+    chunks = []
+    position = len(png_signature)
+    while position < len(png_data):
+        chunk_length, chunk_type = struct.unpack('>I4s', png_data[position:position + 8])
+        chunks.append((chunk_type, png_data[position + 8:position + 8 + chunk_length]))
+        position += 12 + chunk_length
+        if chunk_type == b'IEND':
+            break
+    return chunks
+
+
+def write_png_chunks(chunks):
+    png_data = [png_signature]
+    for chunk_type, chunk_data in chunks:
+        png_data.append(struct.pack('>I', len(chunk_data)))
+        png_data.append(chunk_type + chunk_data)
+        png_data.append(struct.pack('>I', zlib.crc32(chunk_type + chunk_data) & 0xffffffff))
+    return b''.join(png_data)
+
+
+def filter_rows(raw_rows, previous_row, bytes_per_pixel):
+    # Apply every PNG row filter to a block of unfiltered rows (2d uint8 array, 1 row per scanline)
+    # 'previous_row' is the row right above the block (zeros for the first block), returns {filter name: filtered scanlines (with the filter byte)}
+    rows = raw_rows.astype(numpy.int16)
+    left = numpy.zeros_like(rows)
+    left[:, bytes_per_pixel:] = rows[:, :-bytes_per_pixel]
+    up = numpy.vstack((previous_row.astype(numpy.int16)[None, :], rows[:-1]))
+    up_left = numpy.zeros_like(rows)
+    up_left[:, bytes_per_pixel:] = up[:, :-bytes_per_pixel]
+
+    # Paeth picks whichever neighbour (left, up or up left) is closest to  left + up - up_left
+    estimate = left + up - up_left
+    distance_left, distance_up, distance_up_left = numpy.abs(estimate - left), numpy.abs(estimate - up), numpy.abs(estimate - up_left)
+    paeth = numpy.where((distance_left <= distance_up) & (distance_left <= distance_up_left), left, numpy.where(distance_up <= distance_up_left, up, up_left))
+
+    filtered = {
+        'none': rows,
+        'sub': rows - left,
+        'up': rows - up,
+        'average': rows - (left + up) // 2,
+        'paeth': rows - paeth,
+    }
+    filtered = {filter_name: (filtered_rows % 256).astype(numpy.uint8) for filter_name, filtered_rows in filtered.items()}
+    filter_bytes = {filter_name: numpy.full(len(rows), png_filters[filter_name], dtype=numpy.uint8) for filter_name in filtered}
+
+    # 'mixed' uses the best filter for each row, same heuristic libpng uses (smallest sum of the bytes as signed values)
+    filter_names = list(filtered)
+    row_costs = numpy.stack([numpy.abs(filtered[filter_name].view(numpy.int8).astype(numpy.int32)).sum(axis=1) for filter_name in filter_names])
+    best_filters = row_costs.argmin(axis=0)
+    filtered['mixed'] = numpy.choose(best_filters[:, None], [filtered[filter_name] for filter_name in filter_names])
+    filter_bytes['mixed'] = numpy.array([png_filters[filter_names[best_filter]] for best_filter in best_filters], dtype=numpy.uint8)
+
+    return {filter_name: numpy.hstack((filter_bytes[filter_name][:, None], filtered_rows)).tobytes() for filter_name, filtered_rows in filtered.items()}
+
+
+def filtered_scanline_blocks(raw_rows, bytes_per_pixel, block_rows=128):
+    # Filter the image a few rows at a time, a 16 bit 4K frame is ~50 MB unfiltered so we never keep every filtered version of the whole image in memory
+    for block_start in range(0, len(raw_rows), block_rows):
+        previous_row = raw_rows[block_start - 1] if block_start else numpy.zeros(raw_rows.shape[1], dtype=numpy.uint8)
+        yield filter_rows(raw_rows[block_start:block_start + block_rows], previous_row, bytes_per_pixel)
+
+
+def compress_scanlines(scanlines, level, strategy):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, strategy)
+    return compressor.compress(scanlines) + compressor.flush()
+
+
+def optimize_png(png_path):
+    # Lossless recompression of 'png_path' (in place), returns the (original size, new size) in bytes
+    with open(png_path, 'rb') as png_file:
+        png_data = png_file.read()
+    original_size = len(png_data)
+
+    chunks = read_png_chunks(png_data)
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', chunks[0][1])
+    scanlines = zlib.decompress(b''.join(chunk_data for chunk_type, chunk_data in chunks if chunk_type == b'IDAT'))
+
+    bits_per_pixel = png_color_type_channels[color_type] * bit_depth
+    row_length = (width * bits_per_pixel + 7) // 8
+    raw_rows = None
+    if numpy is not None and interlace == 0 and len(scanlines) == height * (row_length + 1):
+        rows = numpy.frombuffer(scanlines, dtype=numpy.uint8).reshape(height, row_length + 1)
+        # We can only filter the rows ourselves if they aren't filtered already (ffmpeg '-pred none')
+        if not rows[:, 0].any():
+            raw_rows = rows[:, 1:]
+
+    if raw_rows is None:
+        # Keep the row filters we got & only try the zlib strategies
+        best_filter = 'original'
+    else:
+        bytes_per_pixel = max(1, bits_per_pixel // 8)
+        # A quick (zlib level 1) compression of every filtered version tells us which filter works best for this image
+        quick_compressors = {filter_name: zlib.compressobj(1, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY) for filter_name in list(png_filters) + ['mixed']}
+        quick_sizes = dict.fromkeys(quick_compressors, 0)
+        for scanline_block in filtered_scanline_blocks(raw_rows, bytes_per_pixel):
+            for filter_name, filtered_block in scanline_block.items():
+                quick_sizes[filter_name] += len(quick_compressors[filter_name].compress(filtered_block))
+        for filter_name, quick_compressor in quick_compressors.items():
+            quick_sizes[filter_name] += len(quick_compressor.flush())
+        best_filter = min(quick_sizes, key=quick_sizes.get)
+        scanlines = b''.join(scanline_block[best_filter] for scanline_block in filtered_scanline_blocks(raw_rows, bytes_per_pixel))
+
+    # Only the best filter gets the (slow) zlib level 9 strategy search, zlib releases the GIL so the strategies run at the same time
+    # Film grain compresses best with Z_RLE while flat/animated content usually does better with the default or Z_FILTERED
+    with ThreadPoolExecutor(max_workers=len(zlib_strategies)) as zlib_executor:
+        compressed_scanlines = min(zlib_executor.map(lambda strategy: compress_scanlines(scanlines, 9, strategy), zlib_strategies), key=len)
+
+    # Keep every other chunk as is (color info, etc), all the image data goes into 1 IDAT chunk right where the first one was
+    optimized_chunks = []
+    for chunk_type, chunk_data in chunks:
+        if chunk_type != b'IDAT':
+            optimized_chunks.append((chunk_type, chunk_data))
+        elif not any(optimized_chunk_type == b'IDAT' for optimized_chunk_type, _ in optimized_chunks):
+            optimized_chunks.append((b'IDAT', compressed_scanlines))
+    optimized_png_data = write_png_chunks(optimized_chunks)
+
+    if len(optimized_png_data) >= original_size:
+        return original_size, original_size
+    with open(f'{png_path}.tmp', 'wb') as optimized_png_file:
+        optimized_png_file.write(optimized_png_data)
+    os.replace(f'{png_path}.tmp', png_path)
+    logging.info(f'Optimized {png_path} using the "{best_filter}" filter: {original_size} -> {len(optimized_png_data)} bytes')
+    return original_size, len(optimized_png_data)
+
+
+def get_img_host_size_limit(img_host):
+    # 'imgbox_max_size_mb=8' in config.env overrides the default limit
+    size_limit_mb = os.getenv(f'{img_host}_max_size_mb')
+    if size_limit_mb:
+        return int(float(size_limit_mb) * 1024 * 1024)
+    return img_host_size_limits.get(img_host)
+
+
+def fit_image_to_host(image_path, img_host):
+    # Returns the image we should upload to 'img_host', thats either the screenshot itself or a lossy copy that fits under the hosts size limit
+    # None means the image is too big & there's no (usable) lossy format set in config.env
+    size_limit = get_img_host_size_limit(img_host)
+    if size_limit is None or os.path.getsize(image_path) < size_limit:
+        return image_path
+
+    lossy_format = str(os.getenv('screenshot_lossy_format', '')).lower().lstrip('.')
+    if lossy_format not in ('jpg', 'webp'):
+        logging.error(f'{image_path} is over the {img_host} limit of {size_limit} bytes & no screenshot_lossy_format is set')
+        return None
+
+    lossy_image_path = f'{os.path.splitext(image_path)[0]}.{lossy_format}'
+    if not os.path.isfile(lossy_image_path):
+        lossy_options = '-q:v 2' if lossy_format == 'jpg' else '-c:v libwebp -quality 90'
+        FFmpeg(inputs={image_path: '-loglevel panic'}, outputs={lossy_image_path: lossy_options}).run()
+    if not os.path.isfile(lossy_image_path) or os.path.getsize(lossy_image_path) >= size_limit:
+        logging.error(f'The {lossy_format} version of {image_path} is still over the {img_host} limit of {size_limit} bytes')
+        return None
+    logging.info(f'Using the {lossy_format} version of {image_path} for {img_host} ({os.path.getsize(image_path)} -> {os.path.getsize(lossy_image_path)} bytes)')
+    return lossy_image_path
@@ -0,0 +1,53 @@
+import time
+import hashlib
+import logging
+from sqlite_cache import SqliteCache
+
+
+# Remembers which screenshots we already uploaded (by their content hash) & the bbcode each image host gave us for them
+# Screenshots are taken at the same timestamps every time so a retry, or uploading the same file to another tracker later, produces the same images
+# & we can reuse the links instead of uploading them again
+#
+# Links are only reused for 'ttl_days' after they were uploaded (image hosts can remove old images) & only the 'max_entries' most recently used links are kept
+class UploadCache(SqliteCache):
+    def __init__(self, db_path, ttl_days=30, max_entries=5000):
+        self.ttl_seconds = float(ttl_days) * 86400
+        self.max_entries = int(max_entries)
+        super().__init__(db_path, enabled=self.ttl_seconds > 0 and self.max_entries > 0, schema=[
+            "CREATE TABLE IF NOT EXISTS uploads ("
+            "sha256 TEXT, img_host TEXT, bbcode TEXT, uploaded REAL, last_used REAL, "
+            "PRIMARY KEY (sha256, img_host))",
+            "CREATE INDEX IF NOT EXISTS uploads_last_used ON uploads (last_used)"])
+
+    @staticmethod
+    def image_hash(image_path):
+        sha256 = hashlib.sha256()
+        with open(image_path, 'rb') as image:
+            for block in iter(lambda: image.read(1048576), b''):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def get(self, image_hash, img_host):
+        if not self.enabled:
+            return None
+        with self._locked_connection() as conn:
+            row = conn.execute("SELECT bbcode, uploaded FROM uploads WHERE sha256=? AND img_host=?", (image_hash, img_host)).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > self.ttl_seconds:
+                # Too old, the image host might have removed it by now
+                conn.execute("DELETE FROM uploads WHERE sha256=? AND img_host=?", (image_hash, img_host))
+                return None
+            conn.execute("UPDATE uploads SET last_used=? WHERE sha256=? AND img_host=?", (time.time(), image_hash, img_host))
+        return row[0]
+
+    def put(self, image_hash, img_host, bbcode):
+        if not self.enabled:
+            return
+        with self._locked_connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?)", (image_hash, img_host, bbcode, time.time(), time.time()))
+            # Remove expired links & then the least recently used ones until we are back under 'max_entries'
+            conn.execute("DELETE FROM uploads WHERE uploaded < ?", (time.time() - self.ttl_seconds,))
+            evicted_entries = self._evict_by_count(conn, table='uploads', max_entries=self.max_entries)
+        if evicted_entries:
+            logging.info(f"Evicted {evicted_entries} old screenshot links from the upload cache")
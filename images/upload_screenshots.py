@@ -1,129 +1,505 @@
 import os
 import sys
-import base64
+import json
+import zlib
+import struct
+import io
+import uuid
+import shlex
+import mimetypes
+import queue
 import asyncio
+import time
 import logging
 import pyimgbox
 import requests
-from ffmpy import FFmpeg
-from datetime import datetime
+import subprocess
+from ffmpy import FFmpeg, FFprobe, FFRuntimeError, FFExecutableNotFoundError
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from dotenv import load_dotenv
-from rich.progress import track
+from rich.progress import Progress
 from rich.console import Console
+from images.upload_cache import UploadCache
+from images.host_stats import ImgHostStats
+from images.frame_quality import get_number_of_candidates, pick_best_frames
+from images.png_optimize import ffmpeg_png_options, screenshot_optimization_enabled, optimize_png, fit_image_to_host
 
 # For more control over rich terminal content, import and construct a Console object.
 console = Console()
 
 
-def get_ss_range(duration, num_of_screenshots):
-    list_of_ss_timestamps = []
-    # Now start a loop that will run for the num_of_screenshots & create evenly split timestamps at which to take screenshots
-    first_time_stamp = int(duration) / int(int(num_of_screenshots) + 1)
-    for num_screen in range(1, int(num_of_screenshots) + 1):
-        millis = round(first_time_stamp) * num_screen
-        list_of_ss_timestamps.append(str(datetime.strptime("%d:%d:%d" % (int((millis / (1000 * 60 * 60)) % 24), int((millis / (1000 * 60)) % 60), int((millis / 1000) % 60)), '%H:%M:%S').time()))
-    # Return the list that contains timestamps at which we'll take screenshots next
-    return list_of_ss_timestamps
+def format_ss_timestamp(seconds, separator=':'):
+    # 'HH:MM:SS' (or 'HH.MM.SS' for file names), hours keep counting past 24
+    whole_seconds = int(seconds)
+    return separator.join(f'{part:02d}' for part in (whole_seconds // 3600, whole_seconds // 60 % 60, whole_seconds % 60))
 
 
-def upload_screens(img_host, img_host_api, image_path, torrent_title):
-    # ptpimg does all for us to upload multiple images at the same time but to simplify things & allow for simple "backup hosts"/upload failures we instead upload 1 image at a time
+def find_keyframes(upload_media, target_seconds):
+    # Returns the time (in seconds from the start of the video) of the keyframe at/before each target or None if we couldn't find it
     #
-    # Both imgbb & freeimage are based on Chevereto which the API has us upload 1 image at a time while imgbox uses something custom and we upload a list of images at the same time
+    # ffprobe seeks to every target (-read_intervals) & reads 1 video packet from there, for indexed containers (mkv/mp4) that's the keyframe at/before the target
+    # That way we only read a handful of packets instead of the whole file. Interval timestamps are absolute so we need the streams start time first (m2ts usually doesn't start at 0)
+    ffprobe_format = FFprobe(inputs={upload_media: None}, global_options=['-v', 'quiet', '-print_format', 'json', '-show_entries', 'format=start_time']).run(stdout=subprocess.PIPE)
+    start_time = float(json.loads(ffprobe_format[0].decode('utf-8')).get('format', {}).get('start_time', 0) or 0)
+
+    read_intervals = ','.join(f'{start_time + seconds:.6f}%+#1' for seconds in target_seconds)
+    ffprobe_packets = FFprobe(inputs={upload_media: None}, global_options=[
+        '-v', 'quiet', '-print_format', 'json', '-select_streams', 'v:0',
+        '-read_intervals', read_intervals, '-show_entries', 'packet=pts_time,flags']).run(stdout=subprocess.PIPE)
+    packets = json.loads(ffprobe_packets[0].decode('utf-8')).get('packets', [])
+
+    keyframes = [float(packet['pts_time']) - start_time for packet in packets if 'K' in packet.get('flags', '') and packet.get('pts_time') not in (None, 'N/A')]
+    # Match each target with the closest keyframe that isn't after it (or after it by less than a frame, rounding), anything else means the seek didn't land on a keyframe
+    return [max((keyframe for keyframe in keyframes if keyframe <= seconds + 0.001), default=None) for seconds in target_seconds]
+
+
+def plan_ss_timestamps(upload_media, duration, num_of_screenshots):
+    # Evenly split the video (duration is in milliseconds) & move each timestamp back to the keyframe right before it
+    # so ffmpeg only has to decode 1 frame per screenshot no matter how long the GOPs are
+    # Returns the timestamps in seconds (microsecond accurate, the same precision ffprobe gives us the keyframes pts in), ffmpeg takes them as is with '-ss'
+    target_seconds = [round(int(duration) * num_screen / (int(num_of_screenshots) + 1)) / 1000 for num_screen in range(1, int(num_of_screenshots) + 1)]
+
+    try:
+        keyframes = find_keyframes(upload_media=upload_media, target_seconds=target_seconds)
+    except (FFRuntimeError, FFExecutableNotFoundError, ValueError, KeyError) as ffprobe_error:
+        logging.error(f'Could not read the keyframes of {upload_media}, using the exact timestamps instead: {ffprobe_error}')
+        keyframes = [None] * len(target_seconds)
+
+    ss_timestamps = []
+    for seconds, keyframe in zip(target_seconds, keyframes):
+        # If the keyframe is too far back (or was already used for the previous screenshot) we just use the exact timestamp
+        previous_timestamp = ss_timestamps[-1] if ss_timestamps else -1
+        if keyframe is not None and keyframe > previous_timestamp and seconds - keyframe < target_seconds[0] / 2:
+            # The exact keyframe pts, rounding it (even to the ms) could put us after the keyframe & ffmpeg would have to decode up to the next frame again
+            ss_timestamps.append(round(keyframe, 6))
+        else:
+            ss_timestamps.append(seconds)
+    logging.info(f'Screenshot targets {target_seconds} moved to the keyframes at {ss_timestamps}')
+    return ss_timestamps
+
+
+def get_screenshot_workers(num_of_screenshots):
+    # How many ffmpeg processes we run at the same time, 'screenshot_workers' in config.env
+    # By default we use half the cpu cores since ffmpeg already uses a few threads to decode each frame (4K HEVC especially)
+    screenshot_workers = os.getenv('screenshot_workers')
+    if screenshot_workers and screenshot_workers.isdigit() and int(screenshot_workers) > 0:
+        workers = int(screenshot_workers)
+    else:
+        workers = max(1, (os.cpu_count() or 2) // 2)
+    # No point in starting more workers than we have screenshots to take
+    return max(1, min(workers, int(num_of_screenshots)))
+
+
+def take_screenshot(upload_media, ss_timestamp, screenshot_path):
+    FFmpeg(inputs={upload_media: f'-loglevel panic -ss {ss_timestamp:.6f}'}, outputs={screenshot_path: f'-frames:v 1 {ffmpeg_png_options()}'}).run()
+    return screenshot_path
+
+
+def take_screenshots_single_pass(upload_media, ss_timestamps, screenshot_paths):
+    # 'screenshot_mode=single_pass', instead of 1 ffmpeg process per screenshot we start 1 process that takes all of them
+    # Every screenshot gets its own input (the same file with its own '-ss' input seek) mapped to its own output, so ffmpeg still only seeks
+    # to each timestamp & decodes 1 frame there instead of reading through the whole file (a single input with a select filter would have to demux everything in between)
+    # ffmpeg still opens & probes the file (and reads its index) once per input, all this saves is starting a new ffmpeg process for every screenshot
+    # ffmpy only takes 1 set of options per input file so the repeated '-ss <timestamp> -i <file>' inputs go in as global options (they come right before the inputs)
+    repeated_inputs = [f'-ss {seconds:.6f} -i {shlex.quote(upload_media)}' for seconds in ss_timestamps]
+    outputs = {screenshot_path: ['-map', f'{index}:v:0', '-frames:v', '1', *ffmpeg_png_options().split()] for index, screenshot_path in enumerate(screenshot_paths)}
+    try:
+        with console.status("Taking screenshots (single pass)..."):
+            FFmpeg(global_options=['-loglevel panic', *repeated_inputs], outputs=outputs).run()
+    except FFRuntimeError as ffmpeg_error:
+        logging.error(f'Single pass screenshots failed, taking them 1 at a time instead: {ffmpeg_error}')
+        return None
+
+    if not all(os.path.isfile(screenshot_path) for screenshot_path in screenshot_paths):
+        logging.error('Single pass screenshots are missing some of the frames, taking them 1 at a time instead')
+        return None
+    return screenshot_paths
+
+
+def optimize_screenshot(screenshot_path):
+    # Returns the (original size, new size) of the screenshot, if something goes wrong we just upload it the way ffmpeg wrote it
+    try:
+        return optimize_png(screenshot_path)
+    except (OSError, ValueError, KeyError, struct.error, zlib.error) as optimize_error:
+        logging.error(f'Failed to optimize {screenshot_path}: {optimize_error}')
+        screenshot_size = os.path.getsize(screenshot_path) if os.path.isfile(screenshot_path) else 0
+        return screenshot_size, screenshot_size
+
+
+def report_optimized_screenshots(screenshot_sizes):
+    # screenshot_sizes is a list of (original size, optimized size) for each screenshot
+    original_size = sum(original for original, _ in screenshot_sizes)
+    optimized_size = sum(optimized for _, optimized in screenshot_sizes)
+
+    saved_percentage = round((original_size - optimized_size) / original_size * 100) if original_size else 0
+    console.print(f'Optimized screenshots: saved [chartreuse1]{(original_size - optimized_size) / 1048576:.1f} MB[/chartreuse1] ({saved_percentage}%)', style='sea_green3', highlight=False)
+    logging.info(f'Optimized screenshots from {original_size} to {optimized_size} bytes (saved {original_size - optimized_size} bytes)')
+
+
+class ImgboxGallery:
+    # Annoyingly pyimgbox requires every upload be apart of a "gallery", we used to create 1 gallery (and 1 event loop) per screenshot
+    # Now all the screenshots of an upload go into the same gallery & every batch of screenshots is uploaded at the same time on 1 event loop
+    def __init__(self, torrent_title):
+        self.loop = asyncio.new_event_loop()
+        self.gallery = pyimgbox.Gallery(title=torrent_title, thumb_width=350)
+
+    async def _upload(self, image_paths):
+        # The gallery has to exist before we start uploading multiple images to it at the same time
+        if not self.gallery.created:
+            try:
+                await self.gallery.create()
+            except (ConnectionError, RuntimeError) as gallery_error:
+                logging.error(f'Failed to create the imgbox gallery: {gallery_error}')
+                return {}
+
+        uploaded_images = {}
+        submissions = await asyncio.gather(*(self.gallery.upload(image_path) for image_path in image_paths), return_exceptions=True)
+        for image_path, submission in zip(image_paths, submissions):
+            if isinstance(submission, Exception):
+                logging.error(f"{image_path}: {submission}")
+            elif not submission['success']:
+                logging.error(f"{submission['filename']}: {submission['error']}")
+            else:
+                logging.info(f'imgbox edit url for {image_path}: {submission["edit_url"]}')
+                uploaded_images[image_path] = f'[url={submission["web_url"]}][img=350x350]{submission["thumbnail_url"]}[/img][/url]'
+        return uploaded_images
+
+    def upload(self, image_paths):
+        return self.loop.run_until_complete(self._upload(image_paths))
+
+    def close(self):
+        self.loop.run_until_complete(self.gallery.close())
+        self.loop.close()
+
+
+class MultipartImageStream:
+    # multipart/form-data body that reads the image from disk while its being sent (requests would build the whole body in memory)
+    # requests uses len() for the Content-Length header & http.client calls read() in blocks to send it
+    def __init__(self, fields, file_field, image_path):
+        self.boundary = uuid.uuid4().hex
+        form_fields = b''.join(f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8') for name, value in fields.items())
+        file_header = (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{os.path.basename(image_path)}"\r\n'
+                       f'Content-Type: {mimetypes.guess_type(image_path)[0] or "application/octet-stream"}\r\n\r\n').encode('utf-8')
+        self.parts = [io.BytesIO(form_fields + file_header), open(image_path, 'rb'), io.BytesIO(f'\r\n--{self.boundary}--\r\n'.encode('utf-8'))]
+        self.length = len(form_fields) + len(file_header) + os.path.getsize(image_path) + len(self.parts[2].getvalue())
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        data = b''
+        while self.parts and (size < 0 or len(data) < size):
+            chunk = self.parts[0].read(-1 if size < 0 else size - len(data))
+            if not chunk:
+                self.parts.pop(0).close()
+                continue
+            data += chunk
+        return data
+
+    def close(self):
+        for part in self.parts:
+            part.close()
+
+
+# imgbb & freeimage uploads share 1 keep-alive session (connection pool) so every screenshot after the first (and every batch after the first) reuses the TLS connections
+# The session is used from the upload threads at the same time, that's fine for plain POSTs (urllib3's pool is thread safe & we don't rely on cookies)
+# 1 pool per host with a connection for each screenshot we upload to that host at the same time
+chevereto_max_uploads = 4
+chevereto_session = requests.Session()
+chevereto_session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=chevereto_max_uploads))
+# (connect, read) timeouts in seconds, a 4K png can take a while to upload on a slow connection
+chevereto_timeout = (10, 120)
+
+
+def upload_to_chevereto(img_host, img_host_api, image_path):
+    # Both imgbb & freeimage are based on Chevereto which the API has us upload 1 image at a time, returns the bbcode or None if the upload failed
+    # Get the correct image host url/json key
+    available_image_host_urls = {'imgbb': 'https://api.imgbb.com/1/upload', 'freeimage': 'https://freeimage.host/api/1/upload'}
+    parent_key = 'data' if img_host == 'imgbb' else 'image'
+    # The image is sent as a file (multipart) instead of base64, imgbb calls that field 'image' & freeimage (Chevereto) calls it 'source'
+    file_field = 'image' if img_host == 'imgbb' else 'source'
+
+    # Stream the img_host_url, api key & image (straight from the disk) as multipart form data & post it
+    image_host_url = available_image_host_urls[img_host]
+    try:
+        image_stream = MultipartImageStream(fields={'key': img_host_api}, file_field=file_field, image_path=image_path)
+        try:
+            img_upload_request = chevereto_session.post(url=image_host_url, data=image_stream, headers={'Content-Type': image_stream.content_type}, timeout=chevereto_timeout)
+        finally:
+            image_stream.close()
+        if img_upload_request.ok:
+            img_upload_response = img_upload_request.json()
+            # When you upload an image you get a few links back, you get 'medium', 'thumbnail', 'url', 'url_viewer' and we only need max 2 so we set the order/list to try and get the ones we want
+            possible_image_types = ['medium', 'thumb']
+            try:
+                for img_type in possible_image_types:
+                    if img_type in img_upload_response[parent_key]:
+                        if 'delete_url' in img_upload_response:
+                            logging.info(f'{img_host} delete url for {image_path}: {img_upload_response["delete_url"]}')
+                        return f'[url={img_upload_response[parent_key]["url_viewer"]}][img=350x350]{img_upload_response[parent_key][img_type]["url"]}[/img][/url]'
+                    else:
+                        return f'[url={img_upload_response[parent_key]["url_viewer"]}][img=350x350]{img_upload_response[parent_key]["url"]}[/img][/url]'
+
+            except KeyError as key_error:
+                logging.error(f'{img_host} json KeyError: {key_error}')
+                return None
+        else:
+            logging.error(f'{img_host} upload failed. JSON Response: {img_upload_request.json()}')
+            console.print(f"{img_host} upload failed. Status code: [bold]{img_upload_request.status_code}[/bold]", style='red3', highlight=False)
+            return None
+    except requests.exceptions.RequestException:
+        logging.error(f"Failed to upload {image_path} to {img_host}")
+        console.print(f"upload to [bold]{img_host}[/bold] has failed!", style="Red")
+        return None
+
+
+def upload_screens(img_host, img_host_api, image_paths, torrent_title, imgbox_gallery=None):
+    # Upload a batch of images to 'img_host' using whatever the host supports for multiple images
+    # Returns a dict of  {image_path: bbcode}  for every image that was uploaded, anything missing failed & gets retried on the next host (if exists)
     #
-    # Annoyingly pyimgbox requires every upload be apart of a "gallery", This is fine if you're uploading a list of multiple images at the same time
-    #  but because of the way we deal with "backup" image hosts/upload failures its not realistic to pass a list of all the images to imgbox at the same time.
-    #  so instead we just upload 1 image at a time to imgbox (also creates 1 gallery per image)
+    # ptpimg takes all the images in 1 request, imgbox uploads them all at the same time into 1 gallery & imgbb/freeimage (1 image per request) get parallel requests
 
     if img_host == 'ptpimg':
         try:
             import ptpimg_uploader
-            ptp_img_upload = ptpimg_uploader.upload(api_key=os.getenv('ptpimg_api_key'), files_or_urls=[image_path], timeout=5)
-            # Make sure the response we get from ptpimg is a list
-            assert type(ptp_img_upload) == list
-            # assuming it is, we can then get the img url, format it into bbcode & return it
+            ptp_img_upload = ptpimg_uploader.upload(api_key=os.getenv('ptpimg_api_key'), files_or_urls=image_paths, timeout=5 * len(image_paths))
+            # Make sure the response we get from ptpimg is a list (with 1 link per image)
+            assert type(ptp_img_upload) == list and len(ptp_img_upload) == len(image_paths)
+            # assuming it is, we can then get the img urls, format them into bbcode & return them
 
             # Pretty sure ptpimg doesn't compress/host multiple 'versions' of the same image so we use the direct image link for both parts of the bbcode (url & img)
-            return True, f'[url={ptp_img_upload[0]}][img=350x350]{ptp_img_upload[0]}[/img][/url]'
+            return {image_path: f'[url={image_url}][img=350x350]{image_url}[/img][/url]' for image_path, image_url in zip(image_paths, ptp_img_upload)}
 
         except ImportError:
             logging.error(msg='cant upload to ptpimg without this pip package: https://pypi.org/project/ptpimg-uploader/')
             console.print(f"\nInstall required pip package: [bold]ptpimg_uploader[/bold] to enable ptpimg uploads\n", style='Red', highlight=False)
-            return False
+            return {}
         except AssertionError:
-            logging.error(msg='ptpimg uploaded an image but returned something unexpected (should be a list)')
+            logging.error(msg='ptpimg uploaded the images but returned something unexpected (should be a list with 1 link per image)')
             console.print(f"\nUnexpected response from ptpimg upload (should be a list). No image link found\n", style='Red', highlight=False)
-            return False
+            return {}
         except Exception:
             logging.error(msg='ptpimg upload failed, double check the ptpimg API Key & try again.')
             console.print(f"\nptpimg upload failed. double check the [bold]ptpimg_api_key[/bold] in [bold]config.env[/bold]\n", style='Red', highlight=False)
-            return False
+            return {}
 
     if img_host in ('imgbb', 'freeimage'):
-        # Get the correct image host url/json key
-        available_image_host_urls = {'imgbb': 'https://api.imgbb.com/1/upload', 'freeimage': 'https://freeimage.host/api/1/upload'}
-        parent_key = 'data' if img_host == 'imgbb' else 'image'
-
-        # Load the img_host_url, api key & img encoded in base64 into a dict called 'data' & post it
-        image_host_url = available_image_host_urls[img_host]
-        data = {'key': img_host_api, 'image': base64.b64encode(open(image_path, "rb").read())}
-        try:
-            img_upload_request = requests.post(url=image_host_url, data=data)
-            if img_upload_request.ok:
-                img_upload_response = img_upload_request.json()
-                # When you upload an image you get a few links back, you get 'medium', 'thumbnail', 'url', 'url_viewer' and we only need max 2 so we set the order/list to try and get the ones we want
-                possible_image_types = ['medium', 'thumb']
-                try:
-                    for img_type in possible_image_types:
-                        if img_type in img_upload_response[parent_key]:
-                            if 'delete_url' in img_upload_response:
-                                logging.info(f'{img_host} delete url for {image_path}: {img_upload_response["delete_url"]}')
-                            return True, f'[url={img_upload_response[parent_key]["url_viewer"]}][img=350x350]{img_upload_response[parent_key][img_type]["url"]}[/img][/url]'
-                        else:
-                            return True, f'[url={img_upload_response[parent_key]["url_viewer"]}][img=350x350]{img_upload_response[parent_key]["url"]}[/img][/url]'
-
-                except KeyError as key_error:
-                    logging.error(f'{img_host} json KeyError: {key_error}')
-                    return False
-            else:
-                logging.error(f'{img_host} upload failed. JSON Response: {img_upload_request.json()}')
-                console.print(f"{img_host} upload failed. Status code: [bold]{img_upload_request.status_code}[/bold]", style='red3', highlight=False)
-                return False
-        except requests.exceptions.RequestException:
-            logging.error(f"Failed to upload {image_path} to {img_host}")
-            console.print(f"upload to [bold]{img_host}[/bold] has failed!", style="Red")
-            return False
+        with ThreadPoolExecutor(max_workers=min(chevereto_max_uploads, len(image_paths)), thread_name_prefix=img_host) as chevereto_executor:
+            image_bbcodes = chevereto_executor.map(lambda image_path: upload_to_chevereto(img_host, img_host_api, image_path), image_paths)
+            return {image_path: image_bbcode for image_path, image_bbcode in zip(image_paths, image_bbcodes) if image_bbcode}
 
     # Instead of coding our own solution we'll use the awesome project https://github.com/plotski/pyimgbox to upload to imgbox
     if img_host == "imgbox":
-        async def imgbox_upload(filepaths):
-            async with pyimgbox.Gallery(title=torrent_title, thumb_width=350) as gallery:
-                async for submission in gallery.add(filepaths):
-                    if not submission['success']:
-                        logging.error(f"{submission['filename']}: {submission['error']}")
-                        return False
-                    else:
-                        logging.info(f'imgbox edit url for {image_path}: {submission["edit_url"]}')
-                        return True, f'[url={submission["web_url"]}][img=350x350]{submission["thumbnail_url"]}[/img][/url]'
-
-        if os.path.getsize(image_path) >= 10485760:  # Bytes
-            logging.error('Screenshot size is over imgbox limit of 10MB, Trying another host (if available)')
-            return False
-
         if sys.version_info < (3, 7):
             logging.critical(f'Required Python version to use pyimgbox is: 3.7+ You currently are on {sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}')
-            return False
+            return {}
+
+        # The size limit (10 MB) is already taken care of by fit_image_to_host()
+        return imgbox_gallery.upload(image_paths)
+
+    return {}
+
+
+def upload_to_img_host(img_host, screenshot_paths, screenshot_hashes, torrent_title, imgbox_gallery, upload_cache, host_stats):
+    # Upload the screenshots to 1 image host, returns a dict of  {screenshot_path: bbcode}  for the ones that worked
+    # If a screenshot is too big for this host we upload a lossy (jpg/webp) copy instead, or skip it
+    images_for_host = {}
+    for screenshot_path in screenshot_paths:
+        try:
+            image_for_host = fit_image_to_host(image_path=screenshot_path, img_host=img_host)
+        except (FFRuntimeError, FFExecutableNotFoundError) as lossy_error:
+            logging.error(f'Failed to make a lossy copy of {screenshot_path} for {img_host}: {lossy_error}')
+            image_for_host = None
+        if image_for_host is not None:
+            images_for_host[image_for_host] = screenshot_path
+    size_rejections = len(screenshot_paths) - len(images_for_host)
+    if not images_for_host:
+        host_stats.record(img_host=img_host, images=0, uploaded=0, seconds=0, size_rejections=size_rejections)
+        return {}
+
+    # call the function that uploads the screenshots
+    upload_start = time.monotonic()
+    uploaded_images = upload_screens(img_host=img_host, img_host_api=os.getenv(f'{img_host}_api_key'), image_paths=list(images_for_host),
+                                     torrent_title=torrent_title, imgbox_gallery=imgbox_gallery)
+    host_stats.record(img_host=img_host, images=len(images_for_host), uploaded=len(uploaded_images), seconds=time.monotonic() - upload_start, size_rejections=size_rejections)
+
+    uploaded_screenshots = {}
+    for image_path, image_bbcode in uploaded_images.items():
+        uploaded_screenshots[images_for_host[image_path]] = image_bbcode
+        if upload_cache.enabled:
+            upload_cache.put(screenshot_hashes[images_for_host[image_path]], img_host, image_bbcode)
+    if len(uploaded_screenshots) < len(screenshot_paths):
+        logging.error(f'{len(screenshot_paths) - len(uploaded_screenshots)}/{len(screenshot_paths)} screenshots failed to upload to {img_host}')
+    return uploaded_screenshots
+
+
+# Host uploads run on these threads so 2 hosts can race each other (hedge_screenshot_uploads), the upload that loses the race
+# keeps going in the background (its links still end up in the upload cache) & is only waited for before that host is used again
+host_upload_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='host_upload')
+host_uploads = {}
+
+
+def host_busy(img_host):
+    # True while the host is still working on an earlier upload (usually a race it lost), we never wait for it to finish before uploading somewhere else
+    return img_host in host_uploads and not host_uploads[img_host].done()
+
+
+def submit_host_upload(img_host, **upload_to_img_host_kwargs):
+    # Uploads to the same host never overlap (all the imgbox uploads go through 1 event loop)
+    # Callers only submit to hosts that aren't busy (see host_busy) so this doesn't wait, it's only here to keep that promise
+    if img_host in host_uploads:
+        wait([host_uploads[img_host]])
+    host_uploads[img_host] = host_upload_executor.submit(upload_to_img_host, img_host=img_host, **upload_to_img_host_kwargs)
+    return host_uploads[img_host]
+
+
+def wait_for_host_uploads():
+    wait(list(host_uploads.values()))
+    host_uploads.clear()
+
+
+def hedged_upload(primary_img_host, secondary_img_host, screenshot_paths, hedge_after_seconds, **upload_to_img_host_kwargs):
+    # Send the screenshots to the primary host & (if it hasn't finished after 'hedge_after_seconds') to the secondary host too, every screenshot uses whichever link comes back first
+    # Returns the  {screenshot_path: bbcode}  dict & the hosts we tried
+    # A host that is still busy with an earlier batch (it lost the last race, it's probably slow or hung right now) is left out instead of waiting for it
+    if host_busy(primary_img_host):
+        if host_busy(secondary_img_host):
+            return {}, []
+        logging.info(f'{primary_img_host} is still busy with the last batch, uploading {len(screenshot_paths)} screenshots to {secondary_img_host} instead')
+        return submit_host_upload(secondary_img_host, screenshot_paths=screenshot_paths, **upload_to_img_host_kwargs).result(), [secondary_img_host]
 
-        imgbox_asyncio_upload = asyncio.run(imgbox_upload(filepaths=[image_path]))
-        if imgbox_asyncio_upload:
-            return True, imgbox_asyncio_upload[1]
+    primary_upload = submit_host_upload(primary_img_host, screenshot_paths=screenshot_paths, **upload_to_img_host_kwargs)
+    if wait([primary_upload], timeout=hedge_after_seconds).done or host_busy(secondary_img_host):
+        return primary_upload.result(), [primary_img_host]
 
-        # # Python 3.7+ version
-        # asyncio.run(imgbox_upload(filepaths=[image_path]))  # call the function that uploads images to imgbox
-        #
-        # # Python <= 3.6 friendly alternative
-        # loop = asyncio.get_event_loop()
-        # loop.run_until_complete(imgbox_upload(list_of_images))
+    logging.info(f'{primary_img_host} is taking longer than {hedge_after_seconds}s, also uploading {len(screenshot_paths)} screenshots to {secondary_img_host}')
+    secondary_upload = submit_host_upload(secondary_img_host, screenshot_paths=screenshot_paths, **upload_to_img_host_kwargs)
+    uploaded_screenshots = {}
+    for host_upload in as_completed([primary_upload, secondary_upload]):
+        for screenshot_path, screenshot_bbcode in host_upload.result().items():
+            uploaded_screenshots.setdefault(screenshot_path, screenshot_bbcode)
+        if len(uploaded_screenshots) == len(screenshot_paths):
+            # Everything is uploaded, no need to wait for the slower host
+            break
+    return uploaded_screenshots, [primary_img_host, secondary_img_host]
+
+
+def upload_screenshots(screenshot_paths, enabled_img_hosts_list, torrent_title, imgbox_gallery, upload_cache, host_stats):
+    # Upload a batch of screenshots, returns a dict of  {screenshot_path: bbcode}  (screenshots that failed on every image host are missing)
+    # Everything goes to the first host & only the screenshots that failed there are retried on the next host (and so on)
+    # Screenshots we've already uploaded to a host before (same content) reuse the link from the upload cache
+    # The host order comes from host_stats (fastest/most reliable first, hosts that keep failing are skipped for a while) & is checked again for every batch
+    screenshot_hashes = {screenshot_path: upload_cache.image_hash(screenshot_path) for screenshot_path in screenshot_paths} if upload_cache.enabled else {}
+    ordered_img_hosts = host_stats.order_hosts(enabled_img_hosts_list)
+
+    uploaded_screenshots = {}
+    for img_host in ordered_img_hosts:
+        for screenshot_path, screenshot_hash in screenshot_hashes.items():
+            if screenshot_path not in uploaded_screenshots:
+                cached_bbcode = upload_cache.get(screenshot_hash, img_host)
+                if cached_bbcode is not None:
+                    logging.info(f'Reusing the {img_host} link for {screenshot_path} from the upload cache')
+                    uploaded_screenshots[screenshot_path] = cached_bbcode
+
+    upload_kwargs = {'screenshot_hashes': screenshot_hashes, 'torrent_title': torrent_title, 'imgbox_gallery': imgbox_gallery, 'upload_cache': upload_cache, 'host_stats': host_stats}
+    remaining_img_hosts = list(ordered_img_hosts)
+    # 'hedge_screenshot_uploads=true' races the first 2 hosts instead of waiting for the first one to fail
+    if str(os.getenv('hedge_screenshot_uploads', 'false')).lower() == 'true' and len(remaining_img_hosts) > 1:
+        remaining_screenshots = [screenshot_path for screenshot_path in screenshot_paths if screenshot_path not in uploaded_screenshots]
+        if remaining_screenshots:
+            hedged_screenshots, tried_img_hosts = hedged_upload(remaining_img_hosts[0], remaining_img_hosts[1], screenshot_paths=remaining_screenshots,
+                                                                hedge_after_seconds=float(os.getenv('hedge_after_seconds') or 0), **upload_kwargs)
+            uploaded_screenshots.update(hedged_screenshots)
+            remaining_img_hosts = [img_host for img_host in remaining_img_hosts if img_host not in tried_img_hosts]
+
+    while remaining_img_hosts:
+        remaining_screenshots = [screenshot_path for screenshot_path in screenshot_paths if screenshot_path not in uploaded_screenshots]
+        if not remaining_screenshots:
+            break
+        # Hosts that are still busy with an earlier (hedged) batch go last, if every host we have left is busy we use whichever one is done first
+        free_img_hosts = [img_host for img_host in remaining_img_hosts if not host_busy(img_host)]
+        if not free_img_hosts:
+            wait([host_uploads[img_host] for img_host in remaining_img_hosts], return_when=FIRST_COMPLETED)
+            continue
+        remaining_img_hosts.remove(free_img_hosts[0])
+        uploaded_screenshots.update(submit_host_upload(free_img_hosts[0], screenshot_paths=remaining_screenshots, **upload_kwargs).result())
+    return uploaded_screenshots
+
+
+def take_and_upload_screenshots(upload_media, ss_timestamps, screenshot_paths, enabled_img_hosts_list, torrent_title, upload_cache, host_stats):
+    # Producer/consumer: the ffmpeg workers take (& optimize) the screenshots and they are queued for uploading the moment they're ready
+    # so the image host uploads happen while ffmpeg is still decoding the rest. Returns the bbcode for each screenshot in timestamp order (None if it failed)
+    #
+    # The uploader takes every screenshot that is ready (waiting for at least 1) & uploads them as 1 batch, by the time that batch is done the next few are usually ready
+    screenshots_taken = False
+    if str(os.getenv('screenshot_mode', 'parallel')).lower() == 'single_pass':
+        logging.info('Taking all the screenshots with a single ffmpeg process')
+        # The screenshots all come out of the same ffmpeg process at the end, only the optimizing & uploading overlap in this mode
+        screenshots_taken = take_screenshots_single_pass(upload_media=upload_media, ss_timestamps=ss_timestamps, screenshot_paths=screenshot_paths) is not None
+
+    screenshot_workers = get_screenshot_workers(num_of_screenshots=len(screenshot_paths))
+    logging.info(f'Taking screenshots with {screenshot_workers} ffmpeg workers')
+    optimize_screenshots = screenshot_optimization_enabled()
+    screenshot_sizes = [None] * len(screenshot_paths)
+    uploaded_screenshots = {}
+    ready_screenshots = queue.Queue()
+
+    def take_screenshot_worker(index):
+        if not screenshots_taken:
+            take_screenshot(upload_media, ss_timestamps[index], screenshot_paths[index])
+        if optimize_screenshots:
+            # Lossless recompression (see images/png_optimize.py), zlib & numpy release the GIL so this runs fine next to the other workers
+            screenshot_sizes[index] = optimize_screenshot(screenshot_paths[index])
+        return index
+
+    imgbox_gallery = ImgboxGallery(torrent_title=torrent_title) if 'imgbox' in enabled_img_hosts_list else None
+    try:
+        with Progress(console=console) as progress, \
+                ThreadPoolExecutor(max_workers=screenshot_workers, thread_name_prefix='screenshot') as screenshot_executor, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix='screenshot_upload') as upload_executor:
+            screenshot_task = progress.add_task("Taking screenshots...", total=len(screenshot_paths))
+            upload_task = progress.add_task("Uploading screenshots...", total=len(screenshot_paths))
+
+            def upload_screenshots_worker():
+                # 'None' in the queue means every screenshot has been taken
+                all_screenshots_taken = False
+                while not all_screenshots_taken:
+                    batch = [ready_screenshots.get()]
+                    while not ready_screenshots.empty():
+                        batch.append(ready_screenshots.get())
+                    all_screenshots_taken = None in batch
+                    batch = [screenshot_path for screenshot_path in batch if screenshot_path is not None]
+                    if batch:
+                        uploaded_screenshots.update(upload_screenshots(screenshot_paths=batch, enabled_img_hosts_list=enabled_img_hosts_list,
+                                                                       torrent_title=torrent_title, imgbox_gallery=imgbox_gallery, upload_cache=upload_cache,
+                                                                       host_stats=host_stats))
+                        progress.advance(upload_task, len(batch))
+
+            upload_future = upload_executor.submit(upload_screenshots_worker)
+            screenshot_futures = [screenshot_executor.submit(take_screenshot_worker, index) for index in range(len(screenshot_paths))]
+            try:
+                for screenshot_future in as_completed(screenshot_futures):
+                    # This re-raises the ffmpeg error (if there was one)
+                    index = screenshot_future.result()
+                    progress.advance(screenshot_task)
+                    ready_screenshots.put(screenshot_paths[index])
+            finally:
+                # Let the uploader finish whatever is already queued (and stop waiting for more)
+                ready_screenshots.put(None)
+            upload_future.result()
+    finally:
+        # A hedged upload that lost the race might still be running
+        wait_for_host_uploads()
+        if imgbox_gallery is not None:
+            imgbox_gallery.close()
+
+    if optimize_screenshots:
+        report_optimized_screenshots(screenshot_sizes)
+    return [uploaded_screenshots.get(screenshot_path) for screenshot_path in screenshot_paths]
 
 
 def take_upload_screens(duration, upload_media_import, torrent_title_import, base_path, discord_url):
@@ -176,41 +552,39 @@ def take_upload_screens(duration, upload_media_import, torrent_title_import, bas
     # ##### Now that we've verified that at least 1 imghost is available & has an api key etc we can try & upload the screenshots ##### #
 
     # Figure out where exactly to take screenshots by evenly dividing up the length of the video
-    ss_timestamps_list = []
-    screenshots_to_upload_list = []
-    for ss_timestamp in track(get_ss_range(duration=duration, num_of_screenshots=num_of_screenshots), description="Taking screenshots..."):
-        # Save the ss_ts to the 'ss_timestamps_list' list
-        ss_timestamps_list.append(ss_timestamp)
-        screenshots_to_upload_list.append(f'{base_path}/images/screenshots/{torrent_title_import} - ({ss_timestamp.replace(":", ".")}).png')
-        # Now with each of those timestamps we can take a screenshot and update the progress bar
-        FFmpeg(inputs={upload_media_import: f'-loglevel panic -ss {ss_timestamp}'}, outputs={f'{base_path}/images/screenshots/{torrent_title_import} - ({ss_timestamp.replace(":", ".")}).png': '-frames:v 1 -q:v 10'}).run()
-    console.print('Finished taking screenshots!\n', style='sea_green3')
+    ss_timestamps_list = plan_ss_timestamps(upload_media=upload_media_import, duration=duration, num_of_screenshots=num_of_screenshots)
+    # 'screenshot_candidates' in config.env, score a few frames around each timestamp & use the best one (skips black frames, fades, credits, etc)
+    number_of_candidates = get_number_of_candidates()
+    if number_of_candidates > 1:
+        with console.status(f"Picking the best of {number_of_candidates} frames for each screenshot..."):
+            ss_timestamps_list = pick_best_frames(upload_media=upload_media_import, ss_timestamps=ss_timestamps_list, number_of_candidates=number_of_candidates,
+                                                  workers=get_screenshot_workers(num_of_screenshots=num_of_screenshots))
+    screenshot_paths = [f'{base_path}/images/screenshots/{torrent_title_import} - ({format_ss_timestamp(ss_timestamp, separator=".")}).png' for ss_timestamp in ss_timestamps_list]
+
     # log the list of screenshot timestamps
     logging.info(f'Taking screenshots at the following timestamps {ss_timestamps_list}')
 
-    # ---------------------------------------------------------------------------------------- #
-
     console.print(f"Image host order: [chartreuse1]{' [bold blue]:arrow_right:[/bold blue] '.join(enabled_img_hosts_list)}[/chartreuse1]", style="Bold Blue")
-    successfully_uploaded_image_count = 0
-    for ss_to_upload in track(screenshots_to_upload_list, description="Uploading screenshots..."):
-        # This is how we fall back to a second host if the first fails
-        for img_host in enabled_img_hosts_list:
-
-            # call the function that uploads the screenshot
-            upload_image = upload_screens(img_host=img_host, img_host_api=os.getenv(f'{img_host}_api_key'), image_path=ss_to_upload, torrent_title=torrent_title_import)
+    upload_cache = UploadCache(db_path=f'{base_path}/cache/screenshot_uploads.sqlite3', ttl_days=os.getenv('screenshot_upload_cache_days') or 30)
+    host_stats = ImgHostStats(db_path=f'{base_path}/cache/img_host_stats.sqlite3', failure_threshold=os.getenv('img_host_failure_threshold') or 3,
+                              cooldown_minutes=os.getenv('img_host_cooldown_minutes') or 15)
+    screenshot_bbcodes = take_and_upload_screenshots(upload_media=upload_media_import, ss_timestamps=ss_timestamps_list, screenshot_paths=screenshot_paths,
+                                                     enabled_img_hosts_list=enabled_img_hosts_list, torrent_title=torrent_title_import, upload_cache=upload_cache,
+                                                     host_stats=host_stats)
+    console.print('Finished taking screenshots!\n', style='sea_green3')
 
-            # If the upload function returns True, we add it to bbcode_images.txt
-            if upload_image:
-                with open(f"{base_path}/temp_upload/bbcode_images.txt", "a") as append_bbcode_txt:
-                    append_bbcode_txt.write(f"{upload_image[1]} ")
-                successfully_uploaded_image_count += 1
-                # Since the image uploaded successfully, we need to break now so we don't reupload to the backup image host (if exists)
-                break
+    # The uploads finish in whatever order, bbcode_images.txt is written in timestamp order once they're all done
+    successfully_uploaded_image_count = 0
+    for screenshot_bbcode in screenshot_bbcodes:
+        if screenshot_bbcode:
+            with open(f"{base_path}/temp_upload/bbcode_images.txt", "a") as append_bbcode_txt:
+                append_bbcode_txt.write(f"{screenshot_bbcode} ")
+            successfully_uploaded_image_count += 1
 
     # Depending on the image upload outcome we print a success or fail message showing the user what & how many images failed/succeeded
-    if len(screenshots_to_upload_list) == successfully_uploaded_image_count:
-        console.print(f'Uploaded {successfully_uploaded_image_count}/{len(screenshots_to_upload_list)} screenshots', style='sea_green3', highlight=False)
-        logging.info(f'Successfully uploaded {successfully_uploaded_image_count}/{len(screenshots_to_upload_list)} screenshots')
+    if len(screenshot_paths) == successfully_uploaded_image_count:
+        console.print(f'Uploaded {successfully_uploaded_image_count}/{len(screenshot_paths)} screenshots', style='sea_green3', highlight=False)
+        logging.info(f'Successfully uploaded {successfully_uploaded_image_count}/{len(screenshot_paths)} screenshots')
     else:
-        console.print(f'{len(screenshots_to_upload_list) - successfully_uploaded_image_count}/{len(screenshots_to_upload_list)} screenshots failed to upload', style='bold red', highlight=False)
-        logging.error(f'{len(screenshots_to_upload_list) - successfully_uploaded_image_count}/{len(screenshots_to_upload_list)} screenshots failed to upload')
+        console.print(f'{len(screenshot_paths) - successfully_uploaded_image_count}/{len(screenshot_paths)} screenshots failed to upload', style='bold red', highlight=False)
+        logging.error(f'{len(screenshot_paths) - successfully_uploaded_image_count}/{len(screenshot_paths)} screenshots failed to upload')
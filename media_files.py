@@ -0,0 +1,125 @@
+import os
+import re
+import logging
+from dataclasses import dataclass
+from typing import Tuple
+
+
+# When uploading a folder we need to pick 1 video file to run mediainfo/ffprobe on (& take screenshots from)
+# Packs usually come with subs, samples, nfo, sfv & proof images so instead of running mediainfo on every file until we find a video track
+# we first filter by extension & the files 'magic bytes', rank whatever is left by size & only probe the winner
+#
+# The upload folder is only walked once (build_tree_manifest), picking the video file & the bluray disc size (BD25/50/66/100)
+# both use that same manifest instead of walking (and stat'ing) the folder again. The files are kept in .torrent order for the hashing
+
+video_file_extensions = ('.mkv', '.mp4', '.m4v', '.mov', '.avi', '.ts', '.m2ts', '.mts', '.wmv', '.mpg', '.mpeg', '.vob', '.webm', '.flv')
+
+# Folders & files with these words in their name are never the main video file
+excluded_name_regex = re.compile(r'(^|[\W_])(sample|proof)s?($|[\W_])', re.IGNORECASE)
+
+
+def has_video_container_magic(path):
+    # Read just enough of the file to recognize the container (mpeg-ts needs to see 2 sync bytes 188/192 bytes apart)
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(200)
+    except OSError:
+        return False
+
+    if header.startswith(b'\x1a\x45\xdf\xa3'):  # Matroska / WebM (EBML)
+        return True
+    if header[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide', b'skip'):  # MP4 / MOV
+        return True
+    if header.startswith(b'RIFF') and header[8:12] == b'AVI ':  # AVI
+        return True
+    if header.startswith(b'\x00\x00\x01\xba'):  # MPEG-PS (vob/mpg)
+        return True
+    if header.startswith(b'\x30\x26\xb2\x75\x8e\x66\xcf\x11'):  # ASF (wmv)
+        return True
+    if header.startswith(b'FLV'):
+        return True
+    if len(header) >= 189 and header[0] == 0x47 and header[188] == 0x47:  # MPEG-TS
+        return True
+    if len(header) >= 197 and header[4] == 0x47 and header[196] == 0x47:  # BDAV M2TS (4 byte timestamp before each packet)
+        return True
+    return False
+
+
+@dataclass(frozen=True)
+class ManifestFile:
+    path: str
+    # Path relative to the manifest root split into its folders & file name, e.g. ('BDMV', 'STREAM', '00055.m2ts')
+    relative_parts: Tuple[str, ...]
+    size: int
+    mtime_ns: int
+
+    @property
+    def is_hidden(self):
+        return any(part.startswith('.') for part in self.relative_parts)
+
+
+@dataclass(frozen=True)
+class TreeManifest:
+    root: str
+    # Every file under 'root' sorted by its relative path (folder by folder), the same order the files end up in a .torrent
+    files: Tuple[ManifestFile, ...]
+
+    @property
+    def total_size(self):
+        return sum(manifest_file.size for manifest_file in self.files)
+
+    def files_in(self, *relative_folder):
+        # All the files inside one of the subfolders, e.g. manifest.files_in('BDMV', 'STREAM')
+        return [manifest_file for manifest_file in self.files if manifest_file.relative_parts[:len(relative_folder)] == relative_folder]
+
+    def largest_file(self, *relative_folder):
+        files = self.files_in(*relative_folder)
+        return max(files, key=lambda manifest_file: manifest_file.size) if files else None
+
+
+def build_tree_manifest(root):
+    # Walk 'root' once with os.scandir (the file type & stat info mostly comes with the directory listing so this is a lot cheaper than os.walk + os.stat)
+    # Like os.walk we don't follow symlinked folders, symlinked files are included with the size of the file they point to
+    if os.path.isfile(root):
+        root_stat = os.stat(root)
+        return TreeManifest(root=root, files=(ManifestFile(path=root, relative_parts=(os.path.basename(root),), size=root_stat.st_size, mtime_ns=root_stat.st_mtime_ns),))
+
+    files = []
+    folders_to_scan = [(root, ())]
+    while folders_to_scan:
+        folder, relative_folder = folders_to_scan.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError as scandir_error:
+            logging.error(f"Could not scan the folder: {scandir_error}")
+            continue
+
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    folders_to_scan.append((entry.path, relative_folder + (entry.name,)))
+                elif entry.is_file():
+                    entry_stat = entry.stat()
+                    files.append(ManifestFile(path=entry.path, relative_parts=relative_folder + (entry.name,), size=entry_stat.st_size, mtime_ns=entry_stat.st_mtime_ns))
+            except OSError as stat_error:
+                logging.error(f"Could not stat {entry.path}: {stat_error}")
+
+    files.sort(key=lambda manifest_file: manifest_file.relative_parts)
+    logging.info(f"Built the file manifest for {root}: {len(files)} files")
+    return TreeManifest(root=root, files=tuple(files))
+
+
+def find_video_files(manifest):
+    # Returns all the (possible) video files in the manifest (the upload folder & its subfolders), largest first
+    candidates = []
+    for manifest_file in manifest.files:
+        if manifest_file.is_hidden or any(excluded_name_regex.search(os.path.splitext(part)[0]) for part in manifest_file.relative_parts):
+            continue
+        if manifest_file.relative_parts[-1].lower().endswith(video_file_extensions):
+            candidates.append(manifest_file)
+
+    # Largest file first, for files that are the same size (e.g. episodes) we keep the usual alphabetical order
+    candidates.sort(key=lambda candidate: (-candidate.size, candidate.path))
+    video_files = [candidate.path for candidate in candidates if has_video_container_magic(candidate.path)]
+    logging.info(f"Possible video files in {manifest.root}: {video_files}")
+    return video_files
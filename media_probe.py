@@ -0,0 +1,114 @@
+import json
+import logging
+import subprocess
+
+from ffmpy import FFprobe
+from pymediainfo import MediaInfo
+
+# Stands in for the files path in the cached mediainfo text (see MediaProbe.mediainfo_text)
+mediainfo_path_placeholder = '<xpbot:mediainfo_path>'
+
+
+# Every stage of an upload needs something from mediainfo (codecs, resolution, channels, atmos, duration, mediainfo.txt)
+# Parsing a large remux means a lot of seeking around the file so we parse each file once & share this object between all the stages
+# If a ProbeCache is passed in, the mediainfo output is saved to it & reused the next time we see the same (unchanged) file
+class MediaProbe:
+    def __init__(self, path, cache=None):
+        self.path = path
+        self.cache = cache
+        self._mediainfo_text = None
+        self._ffprobe = None
+
+        def parse_mediainfo():
+            logging.info(f"Parsing {path} with pymediainfo")
+            # We ask for the raw xml (same thing pymediainfo parses internally) so that we can store it in the cache
+            return MediaInfo.parse(path, output="OLDXML")
+
+        if cache is not None:
+            self.media_info = MediaInfo(cache.get_or_probe(path, "mediainfo", parse_mediainfo))
+        else:
+            self.media_info = MediaInfo(parse_mediainfo())
+
+    @property
+    def tracks(self):
+        return self.media_info.tracks
+
+    @property
+    def video_track(self):
+        # In pretty much all cases "media_info.tracks[1]" is going to be the video track and media_info.tracks[2] will be the primary audio track
+        try:
+            return self.tracks[1]
+        except IndexError:
+            return None
+
+    @property
+    def audio_track(self):
+        # I've encountered a media file without an audio track one time... so this can be None
+        try:
+            return self.tracks[2]
+        except IndexError:
+            return None
+
+    def has_track_type(self, track_type):
+        return any(track.track_type == track_type for track in self.tracks)
+
+    @property
+    def duration(self):
+        # Duration (in milliseconds) of the video track, this is used to evenly space out timestamps for screenshots
+        return str(self.video_track.duration).split(".", 1)[0]
+
+    @property
+    def has_atmos(self):
+        # Check if there is an atmos layer (JOC) in any of the audio tracks
+        for track in self.tracks:
+            if track.track_type == 'Audio':
+                if "JOC" in [track.other_format, track.format_additionalfeatures]:
+                    return True
+        return False
+
+    @property
+    def ffprobe(self):
+        # ffprobe is only run once per file (the first time we need it) & we ask for everything (format, all streams & chapters) in that one call
+        # so that every audio decision (channels & codec fallbacks) can be answered from it instead of spawning ffprobe (and reading the container header) again
+        if self._ffprobe is None:
+            def run_ffprobe():
+                logging.info(f"Running ffprobe on {self.path}")
+                ffprobe_output = FFprobe(
+                    inputs={self.path: None},
+                    global_options=[
+                        '-v', 'quiet',
+                        '-print_format', 'json',
+                        '-show_format', '-show_streams', '-show_chapters']
+                ).run(stdout=subprocess.PIPE)
+                return ffprobe_output[0].decode('utf-8')
+
+            if self.cache is not None:
+                self._ffprobe = json.loads(self.cache.get_or_probe(self.path, "ffprobe", run_ffprobe))
+            else:
+                self._ffprobe = json.loads(run_ffprobe())
+        return self._ffprobe
+
+    def ffprobe_streams(self, codec_type):
+        # All the ffprobe streams of one type ('video', 'audio', 'subtitle') in the order they appear in the file
+        return [stream for stream in self.ffprobe.get("streams", []) if stream.get("codec_type") == codec_type]
+
+    @property
+    def ffprobe_audio_stream(self):
+        # The first audio stream (what we used to get with '-select_streams a:0')
+        audio_streams = self.ffprobe_streams("audio")
+        return audio_streams[0] if audio_streams else None
+
+    def mediainfo_text(self, essential_path):
+        # This is the text output we save to mediainfo.txt, it's only needed once per upload so we only generate it when asked
+        # The cached text has the files path replaced by 'mediainfo_path_placeholder', the cache is keyed by the files identity (inode)
+        # so the same text is reused for hardlinks, moved & renamed files which would otherwise show the path from the first run
+        if self._mediainfo_text is None:
+            def parse_mediainfo_text():
+                return str(MediaInfo.parse(self.path, output="text", full=False)).replace(self.path, mediainfo_path_placeholder)
+
+            if self.cache is not None:
+                self._mediainfo_text = self.cache.get_or_probe(self.path, "mediainfo_text_template", parse_mediainfo_text)
+            else:
+                self._mediainfo_text = parse_mediainfo_text()
+        # We remove the full file path for privacy reasons and only show the file (or folder + file) path in the "Complete name"
+        return self._mediainfo_text.replace(mediainfo_path_placeholder, essential_path)
@@ -0,0 +1,48 @@
+import time
+import hashlib
+import logging
+from sqlite_cache import SqliteCache
+
+
+# The .torrent pieces only depend on the files (their content & order) & the piece size, so once we've hashed a release we keep the pieces here
+# Uploading the same release to another tracker next week then only needs a new announce url & source flag instead of hashing 80 GB again
+#
+# Pieces are keyed by the layout of the torrent (the relative path, size & mtime of every file) plus the piece size, if any file is
+# renamed, replaced or touched the key changes & we hash again. The database is size bounded, the least recently used pieces are removed first
+class PieceHashStore(SqliteCache):
+    def __init__(self, db_path, max_size_mb=64):
+        self.max_size_bytes = int(float(max_size_mb) * 1024 * 1024)
+        super().__init__(db_path, enabled=self.max_size_bytes > 0, schema=[
+            "CREATE TABLE IF NOT EXISTS pieces ("
+            "layout_key TEXT, piece_size INTEGER, name TEXT, pieces BLOB, pieces_size INTEGER, last_used REAL, "
+            "PRIMARY KEY (layout_key, piece_size))",
+            "CREATE INDEX IF NOT EXISTS pieces_last_used ON pieces (last_used)"])
+
+    @staticmethod
+    def layout_key(files):
+        # 'files' is a list of (relative path parts, size, mtime_ns) in torrent order
+        layout = hashlib.sha256()
+        for relative_parts, size, mtime_ns in files:
+            layout.update(f"{'/'.join(relative_parts)}\0{size}\0{mtime_ns}\n".encode('utf-8', errors='surrogateescape'))
+        return layout.hexdigest()
+
+    def get(self, layout_key, piece_size):
+        if not self.enabled:
+            return None
+        with self._locked_connection() as conn:
+            row = conn.execute("SELECT pieces, name FROM pieces WHERE layout_key=? AND piece_size=?", (layout_key, piece_size)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE pieces SET last_used=? WHERE layout_key=? AND piece_size=?", (time.time(), layout_key, piece_size))
+
+        logging.info(f"Using the stored piece hashes for {row[1]} ({len(row[0]) // 20} pieces)")
+        return row[0]
+
+    def put(self, layout_key, piece_size, name, pieces):
+        if not self.enabled or not pieces:
+            return
+        with self._locked_connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO pieces VALUES (?, ?, ?, ?, ?, ?)", (layout_key, piece_size, name, pieces, len(pieces), time.time()))
+            total_size = self._evict_by_size(conn, table='pieces', size_column='pieces_size', max_size_bytes=self.max_size_bytes)
+        if total_size is not None:
+            logging.info(f"Evicted old piece hashes from the store, it's now {total_size} bytes")
@@ -0,0 +1,69 @@
+import os
+import time
+import logging
+from sqlite_cache import SqliteCache
+
+
+# mediainfo, ffprobe & bdinfo results only depend on the file that was probed, so we keep them in a small sqlite database between runs
+# That way a retry, a '-reupload' or uploading the same media to another tracker later doesn't need to probe a 60-80 GB remux again
+#
+# Results are keyed by the files identity (device, inode, size, mtime) so if the file is replaced or modified the old result is never used again
+# The database is size bounded, when it gets too big we remove the least recently used results first
+class ProbeCache(SqliteCache):
+    def __init__(self, db_path, max_size_mb=256):
+        self.max_size_bytes = int(float(max_size_mb) * 1024 * 1024)
+        super().__init__(db_path, enabled=self.max_size_bytes > 0, schema=[
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, kind TEXT, "
+            "path TEXT, value TEXT, value_size INTEGER, last_used REAL, "
+            "PRIMARY KEY (device, inode, size, mtime_ns, kind))",
+            "CREATE INDEX IF NOT EXISTS probes_last_used ON probes (last_used)"])
+
+    @staticmethod
+    def file_identity(path):
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return None
+        return file_stat.st_dev, file_stat.st_ino, file_stat.st_size, file_stat.st_mtime_ns
+
+    def get(self, path, kind):
+        if not self.enabled:
+            return None
+        identity = self.file_identity(path)
+        if identity is None:
+            return None
+
+        with self._locked_connection() as conn:
+            row = conn.execute("SELECT value FROM probes WHERE device=? AND inode=? AND size=? AND mtime_ns=? AND kind=?", (*identity, kind)).fetchone()
+            if row is None:
+                # If the file changed since we last probed it, the old results are useless now so remove them
+                conn.execute("DELETE FROM probes WHERE device=? AND inode=? AND kind=? AND (size!=? OR mtime_ns!=?)", (identity[0], identity[1], kind, identity[2], identity[3]))
+                return None
+            conn.execute("UPDATE probes SET last_used=? WHERE device=? AND inode=? AND size=? AND mtime_ns=? AND kind=?", (time.time(), *identity, kind))
+
+        logging.info(f"Using cached '{kind}' probe result for {path}")
+        return row[0]
+
+    def put(self, path, kind, value):
+        if not self.enabled or value is None:
+            return
+        identity = self.file_identity(path)
+        if identity is None:
+            return
+
+        with self._locked_connection() as conn:
+            conn.execute("DELETE FROM probes WHERE device=? AND inode=? AND kind=?", (identity[0], identity[1], kind))
+            conn.execute("INSERT INTO probes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (*identity, kind, str(path), value, len(value.encode('utf-8')), time.time()))
+            total_size = self._evict_by_size(conn, table='probes', size_column='value_size', max_size_bytes=self.max_size_bytes)
+        if total_size is not None:
+            logging.info(f"Evicted old probe results from the cache, it's now {total_size} bytes")
+
+    def get_or_probe(self, path, kind, probe):
+        # Return the cached result or run 'probe()' and cache what it returns
+        cached_value = self.get(path, kind)
+        if cached_value is not None:
+            return cached_value
+        value = probe()
+        self.put(path, kind, value)
+        return value
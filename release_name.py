@@ -0,0 +1,241 @@
+import os
+import re
+import sys
+import time
+import logging
+from functools import lru_cache
+from types import MappingProxyType
+from dataclasses import dataclass, field
+from typing import Mapping, Optional, Tuple
+
+from guessit import guessit
+
+
+# Every stage of an upload (basic info, codecs, misc details, etc) used to call guessit() & run its own regex over the filename
+# guessit/rebulk is by far the slowest part of that so now we analyze the release name once & store everything in the 'ReleaseName' record below
+# The record is frozen, nothing downstream can change it so each stage reads exactly what was extracted from the filename
+
+# You can add more streaming platforms here, just append the sites 'tag' to the regex below (Case sensitive)
+web_source_regex = re.compile(r'NF|AMZN|iT|ATVP|DSNP|HULU|VUDU|HMAX|iP|CBS|ESPN|STAN|STARZ|NBC|PCOK')
+
+source_type_regex = re.compile(r'(?P<bluray_remux>.*blu(.ray|ray).*remux.*)|'
+                               r'(?P<bluray_disc>.*blu(.ray|ray)((?!x(264|265)|h.(265|264)).)*$)|'
+                               r'(?P<webrip>.*web(.rip|rip).*)|'
+                               r'(?P<webdl>.*web(.dl|dl|).*)|'
+                               r'(?P<bluray_encode>.*blu(.ray|ray).*|x(264|265)|h.(265|264))|'
+                               r'(?P<dvd>HD(.DVD|DVD)|.*DVD.*)|'
+                               r'(?P<hdtv>.*HDTV.*)', re.IGNORECASE)
+
+repack_regex = re.compile(r'RERIP|REPACK|PROPER', re.IGNORECASE)
+
+# regex (sourced and slightly modified from official radarr repo) to find torrent editions (Extended, Criterion, Theatrical, etc)
+# https://github.com/Radarr/Radarr/blob/5799b3dc4724dcc6f5f016e8ce4f57cc1939682b/src/NzbDrone.Core/Parser/Parser.cs#L21
+edition_regex = re.compile(r"((Recut.|Extended.|Ultimate.|Criterion.|International.)?(Director.?s|Collector.?s|Theatrical|Ultimate|Final|Criterion|International(?=(.(Cut|Edition|Version|Collection)))|Extended|Rogue|Special|Despecialized|\d{2,3}(th)?.Anniversary)(.(Cut|Edition|Version|Collection))?(.(Extended|Uncensored|Remastered|Unrated|Uncut|IMAX|Fan.?Edit))?|(Uncensored|Remastered|Unrated|Uncut|IMAX|Fan.?Edit|Edition|Restored|(234)in1))")
+
+video_codec_regex = re.compile(r'(?P<HEVC>HEVC)|(?P<AVC>AVC)|'
+                               r'(?P<H265>H(.265|265))|'
+                               r'(?P<H264>H(.264|264))|'
+                               r'(?P<x265>x265)|(?P<x264>x264)|'
+                               r'(?P<MPEG2>MPEG(-2|2))|'
+                               r'(?P<VC1>VC(-1|1))', re.IGNORECASE)
+
+# This regex is mainly for bluray_discs (DTS-HD.MA & TrueHD are the 2 most popular Bluray Disc audio codecs)
+bluray_disc_audio_codec_regex = re.compile(r'(?P<TrueHD>TrueHD)|(?P<DTSHDMA>DTS-HD.MA)', re.IGNORECASE)
+
+dts_audio_regex = re.compile(r'DTS(-HD(.MA\.)|-ES\.|(.x\.|x\.)|(.HD\.|HD\.)|)', re.IGNORECASE)
+
+audio_channels_regex = re.compile(r'\s[0-9]\s[0-9]\s')
+
+# End user can add their own 'key_words' that they might want to extract and add to the final torrent title
+key_words = {'remux': 'REMUX', 'hdr': 'HDR', 'uhd': 'UHD', 'hybrid': 'Hybrid', 'atmos': 'Atmos'}
+
+# Bluray disc regions
+bluray_regions = ("USA", "FRE", "GBR", "GER", "CZE", "EUR", "CAN", "TWN", "AUS", "BRA", "ITA", "ESP", "HKG", "JPN", "NOR", "FRA")
+
+
+@dataclass(frozen=True)
+class ReleaseName:
+    # The path we analyzed & the file/folder name we run our own regex on
+    path: str
+    raw_file_name: str
+    # Everything guessit returned (read only)
+    guess: Mapping = field(repr=False)
+
+    # --- The rest is extracted from 'raw_file_name' using our own regex --- #
+    source_type: Optional[str] = None
+    web_source: Optional[str] = None
+    repack: Optional[str] = None
+    edition: Optional[str] = None
+    # (lowercase key, title value) pairs from 'key_words' e.g. (('hdr', 'HDR'), ('remux', 'REMUX'))
+    key_words: Tuple[Tuple[str, str], ...] = ()
+    region: Optional[str] = None
+    dv: bool = False
+    video_codec: Optional[str] = None
+    bluray_disc_audio_codec: Optional[str] = None
+    dts_audio_codec: Optional[str] = None
+    audio_channels: Optional[str] = None
+
+    def get(self, key, default=None):
+        return self.guess.get(key, default)
+
+    def __contains__(self, key):
+        return key in self.guess
+
+    def __getitem__(self, key):
+        return self.guess[key]
+
+
+def get_raw_file_name(path):
+    # For folders we want the folder name, for regular movies and single video files we just get the filename
+    if os.path.isdir(path):
+        return os.path.basename(os.path.dirname(f"{path}/"))
+    return os.path.basename(path)
+
+
+def _match_source_type(raw_file_name):
+    match_source = source_type_regex.search(raw_file_name)
+    if match_source is None:
+        return None
+    source_type = None
+    for possible_source_type in ["bluray_disc", "bluray_remux", "bluray_encode", "webdl", "webrip", "dvd", "hdtv"]:
+        if match_source.group(possible_source_type) is not None:
+            source_type = possible_source_type
+    return source_type
+
+
+def _match_video_codec(raw_file_name):
+    match_video_codec = video_codec_regex.search(raw_file_name)
+    if match_video_codec is None:
+        return None
+    rename_codec = {'VC1': 'VC-1', 'MPEG2': 'MPEG-2', 'H264': 'H.264', 'H265': 'H.265'}
+    for video_codec in ["HEVC", "AVC", "H265", "H264", "x265", "x264", "MPEG2", "VC1"]:
+        if match_video_codec.group(video_codec) is not None:
+            # if its not in the rename_codec dict then its AVC/HEVC or x265/x264
+            return rename_codec.get(video_codec, video_codec)
+    return None
+
+
+def _match_bluray_disc_audio_codec(raw_file_name):
+    match_audio_codec = bluray_disc_audio_codec_regex.search(raw_file_name.replace(".", " "))
+    if match_audio_codec is None:
+        return None
+    for audio_codec in ["TrueHD", "DTSHDMA"]:
+        if match_audio_codec.group(audio_codec) is not None:
+            return "DTS-HD MA" if audio_codec == "DTSHDMA" else audio_codec
+    return None
+
+
+def _match_audio_channels(raw_file_name):
+    # First split the filename by '-' & '.' then search for the audio channels
+    match_channels = audio_channels_regex.search(re.sub(r'[-.]', ' ', raw_file_name))
+    if match_channels is None:
+        return None
+    match_channels = match_channels.group().split()
+    mid_pos = len(match_channels) // 2
+    possible_audio_channels = str(' '.join(match_channels[:mid_pos] + ["."] + match_channels[mid_pos:]).replace(" ", ""))
+    # Because this isn't something I've tested extensively I'll only consider it a valid match if its a super common channel layout (e.g.  7.1  |  5.1  |  2.0  etc)
+    if possible_audio_channels in ['1.0', '2.0', '5.1', '7.1']:
+        return possible_audio_channels
+    return None
+
+
+@lru_cache(maxsize=32)
+def parse_release_name(path):
+    # This is the only place we call guessit for an upload, the result is cached so any stage asking about the same path gets the same record back
+    raw_file_name = get_raw_file_name(path)
+    guess = MappingProxyType(dict(guessit(path)))
+
+    found_key_words = {}
+    region = None
+    dv = False
+    for word in raw_file_name.replace(" ", ".").replace("-", ".").split("."):
+        if word.lower() in key_words:
+            found_key_words[word.lower()] = key_words[word.lower()]
+        if word.upper() in bluray_regions:
+            region = word.upper()
+        if any(x in word.lower() for x in ['dv', 'dovi']):
+            dv = True
+
+    match_web_source = web_source_regex.search(raw_file_name)
+    match_repack = repack_regex.search(raw_file_name)
+    match_edition = edition_regex.search(path)
+    match_dts_audio = dts_audio_regex.search(raw_file_name.replace(" ", "."))
+
+    release_name = ReleaseName(
+        path=path,
+        raw_file_name=raw_file_name,
+        guess=guess,
+        source_type=_match_source_type(raw_file_name),
+        web_source=match_web_source.group() if match_web_source else None,
+        repack=match_repack.group() if match_repack else None,
+        edition=match_edition.group().replace(".", " ") if match_edition else None,
+        key_words=tuple(found_key_words.items()),
+        region=region,
+        dv=dv,
+        video_codec=_match_video_codec(raw_file_name),
+        bluray_disc_audio_codec=_match_bluray_disc_audio_codec(raw_file_name),
+        dts_audio_codec=match_dts_audio.group().upper().replace(".", " ").strip() if match_dts_audio else None,
+        audio_channels=_match_audio_channels(raw_file_name)
+    )
+    logging.info(f"Analyzed the release name: {raw_file_name}")
+    return release_name
+
+
+# ---------------------------------------------------------------------- #
+#              Benchmark:  python3 release_name.py [rounds]              #
+# ---------------------------------------------------------------------- #
+# A handful of real release names covering movies, episodes, season packs, daily shows, remuxs, discs & webdls
+benchmark_release_names = (
+    "La.La.Land.2016.1080p.UHD.BluRay.DDP7.1.HDR.x265-NCmt.mkv",
+    "Atomic.Blonde.2017.1080p.UHD.BluRay.DD+7.1.HDR.x265-NCmt.mkv",
+    "Rogue.2020.1080p.BluRay.DD.5.1.x264-BHDStudio.mp4",
+    "Get.Him.to.the.Greek.2010.Unrated.1080p.BluRay.REMUX.AVC.DTS-HD.MA.5.1-EPSiLON.mkv",
+    "The.Hobbit.An.Unexpected.Journey.2012.Extended.Edition.2160p.UHD.BluRay.REMUX.HDR.HEVC.Atmos-EPSiLON",
+    "Blade.Runner.1982.The.Final.Cut.2160p.UHD.Blu-ray.HEVC.TrueHD.Atmos.7.1-GBR-FraMeSToR",
+    "Moon.Knight.S01E03.The.Friendly.Type.2160p.DSNP.WEB-DL.DDP5.1.Atmos.DV.HEVC-FLUX.mkv",
+    "The.Expanse.S06.1080p.AMZN.WEB-DL.DDP5.1.H.264-NTb",
+    "Severance.S01E01.Good.News.About.Hell.1080p.ATVP.WEB-DL.DDP5.1.H.264-CasStudio.mkv",
+    "The.Daily.Show.2022.03.14.Ketanji.Brown.Jackson.720p.WEB.h264-KOGi.mkv",
+    "Formula1.2022.Round01.Bahrain.Race.1080p.WEB.h264-VERUM.mkv",
+    "Succession.S03E09.All.the.Bells.Say.REPACK.1080p.HMAX.WEB-DL.DD5.1.H.264-NTb.mkv",
+    "Dune.2021.Hybrid.1080p.BluRay.DDP5.1.x264-ZoroSenpai.mkv",
+    "Spirited.Away.2001.JPN.1080p.BluRay.AVC.DTS-HD.MA.5.1",
+    "Top.Gun.Maverick.2022.PROPER.2160p.WEB-DL.DDP5.1.Atmos.DV.HDR10.HEVC-CMRG.mkv",
+    "Mad.Men.S01.720p.BluRay.DTS.x264-CtrlHD",
+)
+
+# How many times the old code called guessit() for a typical release (title, year, needed/wanted keys, season/episode & source checks)
+legacy_guessit_calls_per_upload = 20
+
+
+def benchmark(rounds=3):
+    # guessit builds its rebulk rules on the first call, get that out of the way so we only compare the parsing cost
+    guessit(benchmark_release_names[0])
+
+    legacy_start = time.perf_counter()
+    for _ in range(rounds):
+        for release in benchmark_release_names:
+            for _ in range(legacy_guessit_calls_per_upload):
+                guessit(release)
+    legacy_total = time.perf_counter() - legacy_start
+
+    single_pass_start = time.perf_counter()
+    for _ in range(rounds):
+        parse_release_name.cache_clear()
+        for release in benchmark_release_names:
+            record = parse_release_name(release)
+            # Every stage reads from the same record, these lookups should cost nothing
+            for _ in range(legacy_guessit_calls_per_upload):
+                parse_release_name(release).get("title")
+            assert record.raw_file_name == release
+    single_pass_total = time.perf_counter() - single_pass_start
+
+    uploads = rounds * len(benchmark_release_names)
+    print(f"{len(benchmark_release_names)} release names x {rounds} rounds")
+    print(f"Repeated guessit() calls: {legacy_total:0.3f}s total, {1000 * legacy_total / uploads:0.2f}ms per upload")
+    print(f"Single-pass ReleaseName:  {single_pass_total:0.3f}s total, {1000 * single_pass_total / uploads:0.2f}ms per upload")
+    print(f"Speedup: {legacy_total / single_pass_total:0.1f}x")
+
+
+if __name__ == '__main__':
+    benchmark(rounds=int(sys.argv[1]) if len(sys.argv) > 1 else 3)
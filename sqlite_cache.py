@@ -0,0 +1,54 @@
+import os
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+
+
+# The caches we keep between runs (probe results, piece hashes, screenshot links & image host stats) are all small sqlite databases in the cache folder
+# This has the parts they share, each cache only adds its own tables & keys
+#
+# Tables that are size/row limited need a 'last_used' column, the least recently used rows are evicted first once the cache is over its limit
+class SqliteCache:
+    def __init__(self, db_path, schema, enabled=True):
+        # 'schema' is a list of the CREATE TABLE/INDEX IF NOT EXISTS statements for this cache
+        self.db_path = db_path
+        self.enabled = enabled
+        # The background threads (bdinfo scan, hashing, image uploads) use the same caches as the main thread
+        self._lock = threading.Lock()
+
+        if self.enabled:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+            with self._connect() as conn:
+                for statement in schema:
+                    conn.execute(statement)
+
+    def _connect(self):
+        # A short lived connection per call keeps this usable from any thread
+        return closing(sqlite3.connect(self.db_path, timeout=10, isolation_level=None))
+
+    @contextmanager
+    def _locked_connection(self):
+        with self._lock, self._connect() as conn:
+            yield conn
+
+    @staticmethod
+    def _evict_by_size(conn, table, size_column, max_size_bytes):
+        # Remove the least recently used rows until the sum of 'size_column' is back under 'max_size_bytes', returns the new total size (None if nothing was removed)
+        total_size = conn.execute(f"SELECT COALESCE(SUM({size_column}), 0) FROM {table}").fetchone()[0]
+        if total_size <= max_size_bytes:
+            return None
+        for rowid, row_size in conn.execute(f"SELECT rowid, {size_column} FROM {table} ORDER BY last_used ASC").fetchall():
+            if total_size <= max_size_bytes:
+                break
+            conn.execute(f"DELETE FROM {table} WHERE rowid=?", (rowid,))
+            total_size -= row_size
+        return total_size
+
+    @staticmethod
+    def _evict_by_count(conn, table, max_entries):
+        # Remove the least recently used rows until there are only 'max_entries' left, returns how many were removed
+        number_of_entries = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        if number_of_entries <= max_entries:
+            return 0
+        conn.execute(f"DELETE FROM {table} WHERE rowid IN (SELECT rowid FROM {table} ORDER BY last_used ASC LIMIT ?)", (number_of_entries - max_entries,))
+        return number_of_entries - max_entries
@@ -0,0 +1,202 @@
+import os
+import re
+import time
+import queue
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from torf import Torrent, TorfError
+
+
+# Hashing the pieces is the slowest part of an upload (80 GB remuxes, full UHD discs) so instead of torf's generate() we hash them here
+#
+# The files are read in order into a few reusable piece sized buffers (no new bytes object for every piece) & each full buffer is handed to a
+# thread pool, hashlib releases the GIL while it hashes so reading the next pieces & hashing the previous ones happen at the same time on every core
+# torf still decides which files are in the torrent (and their order) & the piece size, we only fill in ['info']['pieces'] so the output is the same
+
+# Files are opened unbuffered, we always read straight into the piece buffers
+file_buffering = 0
+
+# Upper limit for all the piece buffers together (bytes)
+max_buffer_size = 512 * 1048576
+
+
+def get_hashing_workers():
+    # 'torrent_hashing_workers' in config.env, by default 1 per cpu core
+    hashing_workers = os.getenv('torrent_hashing_workers')
+    if hashing_workers and hashing_workers.isdigit() and int(hashing_workers) > 0:
+        return int(hashing_workers)
+    return os.cpu_count() or 1
+
+
+class HashingCancelled(Exception):
+    pass
+
+
+def hash_pieces(filepaths, piece_size, workers=None, callback=None, interval=0.5, stop_event=None):
+    # Returns the concatenated sha1 hashes of every piece (the files are treated as 1 continuous stream like the bittorrent spec says)
+    # 'callback' is called with (filepath, pieces done, total pieces) at most every 'interval' seconds & once all the pieces are done
+    # Setting 'stop_event' (threading.Event) stops hashing & raises HashingCancelled
+    workers = workers or get_hashing_workers()
+    total_size = sum(os.path.getsize(filepath) for filepath in filepaths)
+    pieces_total = -(-total_size // piece_size)
+
+    # A couple of buffers per worker keeps every worker busy while the next piece is read, we never have more than this many pieces (or 'max_buffer_size') in memory
+    free_buffers = queue.Queue()
+    for _ in range(max(2, min(workers * 2, max_buffer_size // piece_size))):
+        free_buffers.put(bytearray(piece_size))
+
+    def hash_piece(piece_buffer, piece_length):
+        try:
+            return hashlib.sha1(memoryview(piece_buffer)[:piece_length]).digest()
+        finally:
+            free_buffers.put(piece_buffer)
+
+    hash_start = time.monotonic()
+    last_callback = 0
+    piece_hashes = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='piece_hashing') as hashing_executor:
+        piece_buffer, piece_position = free_buffers.get(), 0
+        for filepath in filepaths:
+            with open(filepath, 'rb', buffering=file_buffering) as file_to_hash:
+                while True:
+                    bytes_read = file_to_hash.readinto(memoryview(piece_buffer)[piece_position:])
+                    if not bytes_read:
+                        break
+                    piece_position += bytes_read
+                    if piece_position == piece_size:
+                        if stop_event is not None and stop_event.is_set():
+                            raise HashingCancelled(f'Hashing {filepath} was cancelled')
+                        piece_hashes.append(hashing_executor.submit(hash_piece, piece_buffer, piece_position))
+                        # This waits for a buffer to be free if the workers can't keep up with the reads
+                        piece_buffer, piece_position = free_buffers.get(), 0
+
+                        if callback is not None and time.monotonic() - last_callback >= interval:
+                            last_callback = time.monotonic()
+                            callback(filepath, sum(piece_hash.done() for piece_hash in piece_hashes), pieces_total)
+
+        # The last piece is usually shorter than the rest
+        if piece_position:
+            piece_hashes.append(hashing_executor.submit(hash_piece, piece_buffer, piece_position))
+        pieces = b''.join(piece_hash.result() for piece_hash in piece_hashes)
+
+    hash_seconds = time.monotonic() - hash_start
+    logging.info(f'Hashed {len(piece_hashes)} pieces ({total_size / 1048576:.0f} MB) with {workers} workers in {hash_seconds:.1f}s '
+                 f'({total_size / 1048576 / max(hash_seconds, 0.001):.1f} MB/s)')
+    if callback is not None:
+        callback(filepaths[-1] if filepaths else None, len(piece_hashes), pieces_total)
+    return pieces
+
+
+def torrent_layout(torrent, manifest=None):
+    # (relative path parts, size, mtime_ns) of every file in the torrent (in torrent order), the mtimes come from the upload folders manifest if we have one
+    manifest_files = {os.path.normpath(manifest_file.path): manifest_file for manifest_file in manifest.files} if manifest is not None else {}
+    info = torrent.metainfo['info']
+    relative_paths = [(info['name'], *fileinfo['path']) for fileinfo in info['files']] if 'files' in info else [(info['name'],)]
+
+    layout = []
+    for filepath, relative_parts in zip(torrent.filepaths, relative_paths):
+        manifest_file = manifest_files.get(os.path.normpath(str(filepath)))
+        if manifest_file is not None:
+            layout.append((relative_parts, manifest_file.size, manifest_file.mtime_ns))
+        else:
+            file_stat = os.stat(filepath)
+            layout.append((relative_parts, file_stat.st_size, file_stat.st_mtime_ns))
+    return layout
+
+
+def generate_torrent_pieces(torrent, callback=None, interval=0.5, piece_hash_store=None, manifest=None, stop_event=None):
+    # Drop in replacement for torrent.generate(callback=callback), 'callback' gets the same (torrent, filepath, pieces done, total pieces) arguments
+    # If we've hashed the exact same files before (see piece_hash_store.py) we reuse those pieces instead of reading everything again
+    layout_key = None
+    if piece_hash_store is not None and piece_hash_store.enabled:
+        layout_key = piece_hash_store.layout_key(torrent_layout(torrent, manifest=manifest))
+        stored_pieces = piece_hash_store.get(layout_key, torrent.piece_size)
+        if stored_pieces is not None and len(stored_pieces) == torrent.pieces * 20:
+            torrent.metainfo['info']['pieces'] = stored_pieces
+            return True
+
+    filepaths = [str(filepath) for filepath in torrent.filepaths]
+    torrent_callback = (lambda filepath, pieces_done, pieces_total: callback(torrent, filepath, pieces_done, pieces_total)) if callback is not None else None
+    torrent.metainfo['info']['pieces'] = hash_pieces(filepaths=filepaths, piece_size=torrent.piece_size, callback=torrent_callback, interval=interval, stop_event=stop_event)
+
+    if layout_key is not None:
+        piece_hash_store.put(layout_key, torrent.piece_size, torrent.name, torrent.metainfo['info']['pieces'])
+    return True
+
+
+# ---------------------------------------------------------------------- #
+#           Reuse the pieces from the .torrent we downloaded with          #
+# ---------------------------------------------------------------------- #
+# autodl reuploads (-reupload) are files the torrent client just downloaded & verified, the pieces in that .torrent are already what we need
+# (as long as the files & their order are the same) so there's no need to hash them again, only the name/announce/source/private flag are ours
+
+infohash_regex = re.compile(r'^[0-9a-fA-F]{40}$')
+
+
+def find_session_torrent(session_dir, infohash):
+    # rtorrent keeps a copy of every .torrent it has loaded in its session folder named  <INFOHASH>.torrent
+    if not session_dir or not infohash or not infohash_regex.match(infohash):
+        return None
+    for session_torrent in (f'{infohash.upper()}.torrent', f'{infohash.lower()}.torrent'):
+        session_torrent_path = os.path.join(session_dir, session_torrent)
+        if os.path.isfile(session_torrent_path):
+            return session_torrent_path
+    logging.error(f"Could not find {infohash}.torrent in the rtorrent session folder {session_dir}")
+    return None
+
+
+def file_layout(info):
+    # [(path inside the torrent, size)] for every file, single file torrents are just 1 file with an empty path
+    if 'files' in info:
+        return [(tuple(fileinfo['path']), fileinfo['length']) for fileinfo in info['files']]
+    return [((), info['length'])]
+
+
+def reuse_source_torrent_pieces(torrent, source_torrent_path):
+    # Copy the piece size & pieces from 'source_torrent_path' into 'torrent' if both have the exact same files (in the same order) & sizes
+    # Returns True if the pieces were reused, False means we still need to hash the files
+    try:
+        source_torrent = Torrent.read(source_torrent_path)
+    except TorfError as read_error:
+        logging.error(f"Could not read the source .torrent {source_torrent_path}: {read_error}")
+        return False
+
+    source_info = source_torrent.metainfo['info']
+    if file_layout(source_info) != file_layout(torrent.metainfo['info']):
+        logging.error(f"The files in {source_torrent_path} don't match the files we are uploading, hashing them instead")
+        return False
+
+    try:
+        torrent.piece_size = source_torrent.piece_size
+    except TorfError as piece_size_error:
+        # torf only allows piece sizes between 16 KiB & 16 MiB (anything else some trackers won't accept either)
+        logging.error(f"Can't reuse the pieces from {source_torrent_path}: {piece_size_error}")
+        return False
+    torrent.metainfo['info']['pieces'] = source_info['pieces']
+    logging.info(f"Reusing the {len(source_info['pieces']) // 20} pieces ({source_torrent.piece_size} bytes each) from {source_torrent_path}")
+    return True
+
+
+# ---------------------------------------------------------------------- #
+#                         Hashing in the background                        #
+# ---------------------------------------------------------------------- #
+# The pieces don't depend on anything but the files, so we start hashing as soon as we know what we're uploading & everything else
+# (mediainfo, TMDB, screenshots, dupe checks) happens while we hash. Only the announce url & source flag are different for each tracker
+
+# Only 1 .torrent is hashed at a time
+torrent_hashing_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='torrent_hashing')
+
+
+def build_torrent_template(media, exclude_globs, piece_hash_store=None, manifest=None, source_torrent=None, callback=None, stop_event=None):
+    # Returns a private torf Torrent for 'media' with all its pieces, the announce url & source are set later for each tracker
+    torrent = Torrent(media, private=True, exclude_globs=exclude_globs)
+    # autodl reuploads were just downloaded (& verified) by the torrent client, if we have its .torrent we can reuse the pieces instead of hashing everything again
+    if source_torrent is None or not reuse_source_torrent_pieces(torrent, source_torrent):
+        generate_torrent_pieces(torrent, callback=callback, piece_hash_store=piece_hash_store, manifest=manifest, stop_event=stop_event)
+    return torrent
+
+
+def start_torrent_hashing(**build_torrent_template_kwargs):
+    # Returns a Future, call .result() on it to get the Torrent (this also re-raises anything that went wrong)
+    return torrent_hashing_executor.submit(build_torrent_template, **build_torrent_template_kwargs)